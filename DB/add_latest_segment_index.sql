@@ -0,0 +1,11 @@
+-- 티커별 최신 세그먼트 조회용 커버링 인덱스 (기존 DB에 적용)
+-- fetch_all_segments / fetch_latest_ma20_for_tickers / export_to_parquet 모두
+-- ma_type 필터 + ORDER BY ticker, segment_end DESC 패턴 → index-only scan으로 DISTINCT ON 처리
+-- CONCURRENTLY는 트랜잭션 블록 밖에서 실행해야 함 (psql에서 단독 실행)
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS graph_segments_ma_ticker_end_idx
+    ON graph_segments (ma_type, ticker, segment_end DESC)
+    INCLUDE (vector, vector_bin, volatility, segment_start, id);
+
+-- 인덱스 생성 후 통계 갱신 (visibility map 포함 → index-only scan 가능)
+VACUUM ANALYZE graph_segments;
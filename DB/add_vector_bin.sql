@@ -0,0 +1,7 @@
+-- graph_segments에 바이너리 벡터 컬럼 추가
+-- vector_bin: little-endian float32 x 128 (512 bytes), np.frombuffer로 바로 복원
+-- 값은 build_segments.py가 적재 시 함께 채움
+-- 기존 행은 NULL로 남으며, fetch_all_segments가 해당 행만 vector 컬럼으로 대신 읽음
+
+ALTER TABLE graph_segments
+ADD COLUMN IF NOT EXISTS vector_bin BYTEA;
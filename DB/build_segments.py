@@ -1,11 +1,21 @@
 # build_segments.py
 # prices → MA20/30 → 90영업일 구간 → 128 길이 리샘플 + Z정규화 → graph_segments 저장
+#
+# DB 준비: init_tables.sql (신규) 또는 기존 DB에
+#   - add_vector_bin.sql            : vector_bin BYTEA 컬럼
+#   - add_latest_segment_index.sql  : (ma_type, ticker, segment_end DESC) 커버링 인덱스
 
 import os
+import io
+import csv
+from itertools import groupby
+from multiprocessing import Pool
+from operator import itemgetter
 import numpy as np
-import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_batch
+from numpy.lib.stride_tricks import sliding_window_view
+from psycopg2.extensions import AsIs, register_adapter
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -21,76 +31,138 @@ PG_CONN_STR = (
 
 OUT_LEN   = 128        # 벡터 길이
 SEG_DAYS  = 90         # 한 구간 길이(영업일)
-VOL_MIN, VOL_MAX = 0.2, 2.0   # 변동성 컷(정규화 후 표준편차 범위)
+VOL_MIN, VOL_MAX = 0.01, 0.5  # 변동성 컷(리샘플 전 구간 MA의 변동계수 std/mean 범위)
 TICKERS = ["AAPL", "MSFT", "NVDA", "GOOGL", "AMZN"]  # 필요 시 tickers_list.txt 읽어도 됨
 CLEAR_BEFORE_INSERT = True     # 같은 티커/MA 재생성 시 기존 기록 삭제
-
-def resample_z(y: np.ndarray, out_len=128) -> np.ndarray:
-    x_old = np.linspace(0, 1, len(y), dtype=np.float32)
-    x_new = np.linspace(0, 1, out_len, dtype=np.float32)
-    y_new = np.interp(x_new, x_old, y.astype(np.float32))
-    y_new = (y_new - y_new.mean()) / (y_new.std() + 1e-8)  # Z-정규화
-    return y_new
-
-def fetch_adj_close(conn, ticker: str) -> pd.DataFrame | None:
-    with conn.cursor() as cur:
-        cur.execute("""
-            SELECT trade_date, adj_close
-            FROM prices
-            WHERE ticker=%s
-            ORDER BY trade_date
-        """, (ticker,))
-        rows = cur.fetchall()
-    if not rows:
-        return None
-    return pd.DataFrame(rows, columns=["date", "adj"])
+FLUSH_ROWS = 20000             # 여러 티커 구간을 모아 한 번에 적재할 행 수
+N_PROCS = os.cpu_count() or 1  # 구간 계산 프로세스 수
+
+def interp_weights(n_old: int, out_len: int = 128):
+    """선형보간 가중치 (lo, hi, frac) — 입력/출력 길이가 같으면 모든 구간에서 재사용"""
+    idx = np.linspace(0, n_old - 1, out_len)
+    lo = np.floor(idx).astype(np.int32)
+    hi = np.clip(lo + 1, 0, n_old - 1).astype(np.int32)
+    frac = (idx - lo).astype(np.float32)
+    return lo, hi, frac
+
+# (SEG_DAYS → OUT_LEN) 고정 형태이므로 보간 가중치는 모듈 로드 시 한 번만 계산
+LO, HI, FRAC = interp_weights(SEG_DAYS, OUT_LEN)
+
+def segment_vectors(vals: np.ndarray):
+    """
+    MA 시계열 전체를 한 번에 구간화: 슬라이딩 윈도우 → 변동성 컷 → 리샘플 → 행별 Z정규화
+    변동성은 Z정규화 전 원시 구간에서 측정 (정규화 후 표준편차는 항상 ≈1이라 컷이 무의미),
+    컷에서 탈락한 구간은 리샘플/정규화를 아예 하지 않음
+    반환: (구간 시작 인덱스, (M, OUT_LEN) 벡터, 구간 변동계수)
+    """
+    if len(vals) < SEG_DAYS:
+        return np.empty(0, dtype=np.int64), np.empty((0, OUT_LEN), dtype=np.float32), np.empty(0, dtype=np.float32)
+
+    W = sliding_window_view(vals, SEG_DAYS)        # (N, SEG_DAYS) 뷰, 복사 없음
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vol = W.std(axis=1) / np.abs(W.mean(axis=1))  # 가격 수준과 무관한 변동계수
+    mask = (vol >= VOL_MIN) & (vol <= VOL_MAX)     # NaN/inf는 자동 탈락
+
+    Wm = W[mask]
+    R = Wm[:, LO] * (1 - FRAC) + Wm[:, HI] * FRAC  # (M, OUT_LEN)
+    R -= R.mean(axis=1, keepdims=True)
+    R /= (R.std(axis=1, keepdims=True) + 1e-8)     # Z-정규화
+
+    return np.flatnonzero(mask), R, vol[mask]
+
+def vector_bytes(vec: np.ndarray) -> bytes:
+    """벡터 → little-endian float32 BYTEA (OUT_LEN*4 바이트)"""
+    return np.asarray(vec, dtype="<f4").tobytes()
+
+def pg_array_literal(vec: np.ndarray) -> str:
+    """float 벡터 → Postgres 배열 리터럴 '{...}' (9 유효숫자 = float32 왕복 보장)"""
+    return "{" + ",".join(f"{x:.9g}" for x in vec.tolist()) + "}"
+
+# ndarray를 그대로 파라미터로 넘기면 배열 리터럴로 직렬화 (list(map(float, ...)) 박싱 생략)
+register_adapter(np.ndarray, lambda a: AsIs("'" + pg_array_literal(a) + "'"))
+
+def cumsum_ma(a: np.ndarray, w: int) -> np.ndarray:
+    """누적합 기반 이동평균 (O(n)), 길이 len(a)-w+1 — float64로 누적해 오차 방지"""
+    if len(a) < w:
+        return np.empty(0, dtype=np.float64)
+    csum = np.cumsum(a, dtype=np.float64)
+    return (csum[w-1:] - np.concatenate(([0.0], csum[:-w]))) / w
 
 def insert_segments(conn, rows):
     if not rows:
         return
     with conn.cursor() as cur:
-        execute_batch(cur, """
+        execute_values(cur, """
             INSERT INTO graph_segments
-              (ticker, window_start, window_end, ma_window, vec, stdev)
-            VALUES
-              (%s, %s, %s, %s, %s, %s)
-        """, rows, page_size=1000)
-    conn.commit()
-
-def build_for_ticker(conn, ticker: str, ma_window: int):
-    df = fetch_adj_close(conn, ticker)
-    if df is None or df.empty:
-        print(f"[WARN] {ticker}: no adj_close in prices (skip)")
-        return
-
-    # 이동평균 계산
-    df["ma"] = df["adj"].rolling(ma_window).mean()
-    df = df.dropna(subset=["ma"]).reset_index(drop=True)
-
-    vals = df["ma"].to_numpy(dtype=np.float32)
-    dates = df["date"].tolist()
-    rows = []
-
-    for i in range(0, len(vals) - SEG_DAYS + 1):
-        win = vals[i:i+SEG_DAYS]
-        vec = resample_z(win, OUT_LEN)
-        stdev = float(np.std(vec))
-        if VOL_MIN <= stdev <= VOL_MAX:
-            ws, we = dates[i], dates[i+SEG_DAYS-1]
-            # ma_type = f"MA{ma_window}"  # "MA20" 또는 "MA30"
-            rows.append((ticker, ws, we, ma_window, list(map(float, vec)), stdev))
+              (ticker, window_start, window_end, ma_window, vec, vector_bin, stdev)
+            VALUES %s
+        """, rows, page_size=10000)
 
-    # 중복 방지를 원하면 기존 것 삭제
+def copy_segments(conn, rows):
+    """기존 구간을 지운 뒤 초기 적재용 COPY 경로 (vec는 배열 리터럴, vector_bin은 hex bytea)"""
+    if not rows:
+        return
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    for ticker, ws, we, ma_window, vec, vec_bin, stdev in rows:
+        w.writerow((ticker, ws, we, ma_window, pg_array_literal(vec),
+                    "\\x" + vec_bin.hex(), stdev))
+    buf.seek(0)
+    with conn.cursor() as cur:
+        cur.copy_expert("""
+            COPY graph_segments
+              (ticker, window_start, window_end, ma_window, vec, vector_bin, stdev)
+            FROM STDIN WITH (FORMAT csv)
+        """, buf)
+
+def segment_rows(ticker: str, dates: list, adj: np.ndarray, ma_window: int) -> list:
+    """종가(adj) 시계열 → graph_segments 행 리스트 (DB 접근 없는 순수 계산)"""
+    # 이동평균 계산 (누적합)
+    vals = cumsum_ma(adj, ma_window).astype(np.float32)
+    dates = dates[ma_window-1:]
+
+    starts, vecs, stdevs = segment_vectors(vals)
+    return [
+        (ticker, dates[i], dates[i+SEG_DAYS-1], ma_window, vec, vector_bytes(vec), sd)
+        for i, vec, sd in zip(starts.tolist(), vecs, stdevs.tolist())
+    ]
+
+def write_segments(conn, tickers: list[str], ma_window: int, rows):
+    """
+    여러 티커의 구간을 한 트랜잭션으로 적재 (CLEAR_BEFORE_INSERT면 해당 티커 기존 구간 삭제 후 COPY)
+    DELETE + 적재가 한 번의 commit으로 묶여 중간 상태가 보이지 않음
+    """
     if CLEAR_BEFORE_INSERT:
         with conn.cursor() as cur:
             cur.execute("""
                 DELETE FROM graph_segments
-                WHERE ticker=%s AND ma_window=%s
-            """, (ticker, ma_window))
-        conn.commit()
-
-    insert_segments(conn, rows)
-    print(f"[OK] {ticker} MA{ma_window}: inserted {len(rows)} segments")
+                WHERE ticker = ANY(%s) AND ma_window=%s
+            """, (tickers, ma_window))
+        copy_segments(conn, rows)
+    else:
+        insert_segments(conn, rows)
+
+def iter_adj_close(conn, tickers: list[str]):
+    """
+    한 번의 SELECT로 여러 티커 종가를 서버 사이드 커서로 스트리밍, 티커별로 묶어서 반환
+    yield: (ticker, dates, adj ndarray)
+    """
+    with conn.cursor(name="adj_close_stream") as cur:
+        cur.itersize = 100000
+        cur.execute("""
+            SELECT ticker, trade_date, adj_close::float8
+            FROM prices
+            WHERE ticker = ANY(%s) AND adj_close IS NOT NULL
+            ORDER BY ticker, trade_date
+        """, (tickers,))
+        for ticker, grp in groupby(cur, key=itemgetter(0)):
+            grp = list(grp)
+            yield ticker, [r[1] for r in grp], np.fromiter((r[2] for r in grp), dtype=np.float64, count=len(grp))
+
+def _segment_job(args):
+    """Pool 워커: (ticker, dates, adj, ma_window) → (ticker, rows)"""
+    ticker, dates, adj, ma_window = args
+    return ticker, segment_rows(ticker, dates, adj, ma_window)
 
 def fetch_all_tickers(conn) -> list[str]:
     """DB에서 모든 티커 조회"""
@@ -120,28 +192,52 @@ def main():
     print(f"[INFO] Found {len(tickers)} tickers in DB. {len(processed)} already processed.")
     print(f"[INFO] Processing {len(tickers_to_process)} remaining MA20 tickers...")
 
-    # MA20만 처리
-    for t in tickers_to_process:
+    # MA20만 처리: 종가는 SELECT 한 번으로 스트리밍, 구간 계산은 프로세스 풀, 적재는 배치
+    ma_window = 20
+    read_conn = psycopg2.connect(PG_CONN_STR)
+    jobs = ((t, dates, adj, ma_window) for t, dates, adj in iter_adj_close(read_conn, tickers_to_process))
+
+    batch_tickers, batch_rows = [], []
+
+    def flush():
+        nonlocal conn
+        if not batch_tickers:
+            return
         try:
-            build_for_ticker(conn, t, 20)
+            write_segments(conn, batch_tickers, ma_window, batch_rows)
+            conn.commit()
+            print(f"[OK] MA{ma_window}: wrote {len(batch_rows)} segments for {len(batch_tickers)} tickers")
         except psycopg2.OperationalError as e:
-            print(f"\\n[ERROR] Connection lost for {t}: {e}\\nReconnecting...")
+            print(f"\n[ERROR] Connection lost while writing {len(batch_tickers)} tickers: {e}\nReconnecting...")
             try:
                 conn = psycopg2.connect(PG_CONN_STR)
-                build_for_ticker(conn, t, 20)
+                write_segments(conn, batch_tickers, ma_window, batch_rows)
+                conn.commit()
+                print(f"[OK] MA{ma_window}: wrote {len(batch_rows)} segments for {len(batch_tickers)} tickers")
             except Exception as e2:
-                print(f"[ERROR] Failed to process {t} even after reconnect: {e2}")
-                try: 
+                print(f"[ERROR] Failed to write batch even after reconnect: {e2}")
+                try:
                     conn.rollback()
-                except: 
+                except Exception:
                     pass
         except Exception as e:
-            print(f"[ERROR] Failed to process {t}: {e}")
-            try: 
+            print(f"[ERROR] Failed to write batch ({batch_tickers[0]}..{batch_tickers[-1]}): {e}")
+            try:
                 conn.rollback()
-            except: 
+            except Exception:
                 pass
-
+        batch_tickers.clear()
+        batch_rows.clear()
+
+    with Pool(N_PROCS) as pool:
+        for t, rows in pool.imap_unordered(_segment_job, jobs, chunksize=8):
+            batch_tickers.append(t)
+            batch_rows.extend(rows)
+            if len(batch_rows) >= FLUSH_ROWS:
+                flush()
+        flush()
+
+    read_conn.close()
     conn.close()
     print("Done.")
 
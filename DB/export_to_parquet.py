@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
 """
 Render PostgreSQL DB에서 graph_segments 테이블의 데이터를 parquet 파일로 내보내기
+(서버 사이드 커서로 청크 단위 조회 → pyarrow ParquetWriter로 스트리밍 저장)
 """
 import os
 import psycopg2
-import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
-import ast
 
 # .env 로드
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -22,6 +23,31 @@ PG_CONN_STR = (
     f"password={os.getenv('PG_PASSWORD')}"
 )
 
+CHUNK_ROWS = 10000  # 서버 사이드 커서 fetch 크기
+VEC_LEN = 128       # build_segments.OUT_LEN
+
+SCHEMA = pa.schema([
+    ("ticker", pa.string()),
+    ("segment_start", pa.date32()),
+    ("segment_end", pa.date32()),
+    ("vector", pa.list_(pa.float32(), VEC_LEN)),  # 고정 길이 리스트 (컬럼형 연속 저장)
+    ("volatility", pa.float64()),
+])
+
+
+def chunk_to_table(chunk) -> pa.Table:
+    """커서 청크(튜플 리스트) → pyarrow Table (vector는 float32 고정 길이 리스트)"""
+    tickers, starts, ends, vecs, vols = zip(*chunk)
+    flat = np.ascontiguousarray(np.asarray(vecs, dtype=np.float32)).reshape(-1)
+    return pa.Table.from_arrays([
+        pa.array(tickers, type=pa.string()),
+        pa.array(starts, type=pa.date32()),
+        pa.array(ends, type=pa.date32()),
+        pa.FixedSizeListArray.from_arrays(pa.array(flat, type=pa.float32()), VEC_LEN),
+        pa.array(vols, type=pa.float64()),
+    ], schema=SCHEMA)
+
+
 print(f"[INFO] Connecting to Render DB: {os.getenv('PG_DB')}")
 conn = psycopg2.connect(PG_CONN_STR)
 
@@ -39,60 +65,27 @@ query = """
     ORDER BY ticker, window_end DESC;
 """
 
-df = pd.read_sql_query(query, conn)
-conn.close()
-
-print(f"[INFO] Fetched {len(df)} segments")
-
-# vector 컬럼을 numpy array로 변환 (리스트로 저장되어 있을 수 있음)
-"""
-if len(df) > 0:
-    print("[INFO] Converting vector column...")
-    # vector가 문자열이나 리스트로 저장되어 있을 수 있으므로 변환
-    if isinstance(df['vec'].iloc[0], str):
-        # PostgreSQL에서 array로 저장된 경우 문자열로 나올 수 있음
-        import ast
-        df['vec'] = df['vec'].apply(lambda x: np.array(ast.literal_eval(x)) if isinstance(x, str) else np.array(x))
-    elif not isinstance(df['vec'].iloc[0], np.ndarray):
-        df['vec'] = df['vec'].apply(lambda x: np.array(x))
-"""
-if len(df) > 0:
-    print("[INFO] Converting vector column...")
-
-    def convert_vec(x):
-        # 문자열 형태 "[0.1, 0.2, ...]" 인 경우
-        if isinstance(x, str):
-            return np.array(ast.literal_eval(x), dtype=float)
-
-        # 이미 numpy array인 경우
-        if isinstance(x, np.ndarray):
-            return x.astype(float)
-
-        # list/tuple/기타 iterable인 경우
-        return np.array(x, dtype=float)
-
-    df["vec"] = df["vec"].apply(convert_vec)
-
-df = df.rename(columns={
-    "window_start": "segment_start",
-    "window_end": "segment_end",
-    "vec": "vector",
-    "stdev": "volatility",
-})
-
-# 최종 컬럼 순서 정리
-df = df[["ticker", "segment_start", "segment_end", "vector", "volatility"]]
-
-# Parquet로 저장
+# Parquet로 스트리밍 저장
 output_path = os.path.join(BASE_DIR, "..", "data", "ma20.parquet")
 print(f"[INFO] Saving to {output_path}...")
-df.to_parquet(output_path, index=False, engine='pyarrow')
 
-print(f"[OK] Exported {len(df)} segments to ma20.parquet")
+n_rows = 0
+tickers = set()  # 행마다가 아니라 고유 티커만 보관 (메모리 O(티커 수))
+with conn.cursor(name="segs") as cur, pq.ParquetWriter(output_path, SCHEMA) as writer:
+    cur.itersize = CHUNK_ROWS
+    cur.execute(query)
+    while chunk := cur.fetchmany(CHUNK_ROWS):
+        writer.write_table(chunk_to_table(chunk))
+        n_rows += len(chunk)
+        tickers.update(r[0] for r in chunk)
+        print(f"[INFO] Wrote {n_rows} segments...")
+conn.close()
+
+print(f"[OK] Exported {n_rows} segments to ma20.parquet")
 print(f"[INFO] File size: {os.path.getsize(output_path) / 1024 / 1024:.2f} MB")
 
 # 티커 목록 출력
-tickers = sorted(df['ticker'].unique())
+tickers = sorted(tickers)
 print(f"\n[INFO] Total tickers: {len(tickers)}")
 print(f"[INFO] First 20 tickers: {', '.join(tickers[:20])}")
 if len(tickers) > 20:
@@ -3,13 +3,18 @@
 # NASDAQ API → 티커 자동 수집 → Yahoo Finance → PostgreSQL 업서트 (최종)
 # - NASDAQ 스크리너 API로 티커 자동 수집(get_nasdaq_tickers)
 # - .env 로 DB 접속정보 로드 (파일명은 정확히 ".env")
-# - yfinance: group_by="column"으로 단일 컬럼 보장, auto_adjust=True
+# - yfinance: 50개씩 묶음 다운로드(group_by="ticker"), auto_adjust=True
 # - 컬럼 정규화(멀티인덱스/이상 컬럼 대응), NaN은 스킵(0으로 넣지 않음)
-# - execute_batch 업서트
+# - execute_values 업서트 (multi-row INSERT)
+# - 다운로드는 스레드 풀, DB 적재는 단일 writer 스레드가 배치로 처리
 # ------------------------------------------------------------
 
 import os
-import math
+import io
+import csv
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List
 
 import requests
@@ -17,7 +22,7 @@ import yfinance as yf
 import pandas as pd
 import numpy as np
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
 # ===== .env 로드 (.py와 같은 폴더의 .env를 확실히 읽도록 절대경로 사용) =====
@@ -33,6 +38,13 @@ PG_CONN_STR = (
 )
 
 
+DOWNLOAD_WORKERS = 4      # 동시에 다운로드할 티커 묶음 수
+DOWNLOAD_CHUNK = 50       # yf.download 한 번에 요청할 티커 수
+WRITE_BATCH_ROWS = 5000   # writer가 한 번에 적재할 prices 행 수
+COMMIT_EVERY = 100        # N개 티커마다 commit (티커마다 WAL fsync 하지 않도록)
+OHLCV_COLS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+
 # ===== 기본 티커(백업용) =====
 FALLBACK_TICKERS: List[str] = ["AAPL", "MSFT", "NVDA", "GOOGL", "AMZN"]
 
@@ -44,7 +56,7 @@ def read_tickers_json(limit: int = 1000) -> List[str] | None:
     json_path = os.path.join(BASE_DIR, "..", "data", "tickers_nasdaq.json")
     if os.path.exists(json_path):
         try:
-            with open(json_path) as f:
+            with open(json_path, "rb") as f:  # 바이트로 읽어 json이 직접 디코딩
                 all_tickers = json.load(f)
             # 상위 limit개만 반환
             ts = all_tickers[:limit] if len(all_tickers) > limit else all_tickers
@@ -132,48 +144,36 @@ def resolve_tickers(limit: int = 1000) -> List[str]:
     return FALLBACK_TICKERS
 
 
-def safe_float(x) -> float | None:
-    """float 캐스팅; NaN/None이면 None 반환 (0으로 넣지 않기 위함)"""
-    try:
-        if x is None or (isinstance(x, float) and math.isnan(x)):
-            return None
-        return float(x)
-    except Exception:
-        return None
-
-
-def safe_int(x) -> int | None:
-    """int 캐스팅; NaN/None이면 None 반환"""
-    try:
-        if x is None or (isinstance(x, float) and math.isnan(x)):
-            return None
-        return int(x)
-    except Exception:
-        return None
+def stock_meta_row(ticker: str, info: Dict) -> tuple:
+    """yfinance info → stocks 테이블 행"""
+    return (
+        ticker,
+        info.get("longName") or info.get("shortName") or None,
+        info.get("exchange"),
+        info.get("sector"),
+        info.get("marketCap") or 0,
+    )
 
 
-def upsert_stock_meta(conn, ticker: str, info: Dict):
-    """stocks 테이블 업서트"""
+def upsert_stock_meta_batch(conn, meta_rows: List[tuple]):
+    """stocks 테이블 배치 업서트 (execute_values, commit은 호출자가)"""
+    if not meta_rows:
+        return
     with conn.cursor() as cur:
-        cur.execute(
+        execute_values(
+            cur,
             """
             INSERT INTO stocks (ticker, company_name, exchange, sector, market_cap)
-            VALUES (%s,%s,%s,%s,%s)
+            VALUES %s
             ON CONFLICT (ticker) DO UPDATE SET
               company_name=EXCLUDED.company_name,
               exchange=EXCLUDED.exchange,
               sector=EXCLUDED.sector,
               market_cap=EXCLUDED.market_cap;
             """,
-            (
-                ticker,
-                info.get("longName") or info.get("shortName") or None,
-                info.get("exchange"),
-                info.get("sector"),
-                info.get("marketCap") or 0,
-            ),
+            meta_rows,
+            page_size=10000,
         )
-    conn.commit()
 
 
 def normalize_ohlcv_columns(df: pd.DataFrame, ticker: str) -> pd.DataFrame | None:
@@ -220,45 +220,74 @@ def normalize_ohlcv_columns(df: pd.DataFrame, ticker: str) -> pd.DataFrame | Non
         c_vol: "Volume",
     }
     df = df.rename(columns=rename_map)
-    df = df[["Open", "High", "Low", "Close", "Adj Close", "Volume"]]
+    df = df[OHLCV_COLS]
     return df
 
 
-def upsert_prices(conn, ticker: str, df: pd.DataFrame):
-    """prices 테이블 대량 업서트 (정규화 + NaN 행 스킵)."""
+def copy_prices(conn, rows):
+    """신규 티커 초기 적재용 COPY 경로 (충돌 없음이 보장될 때만 사용, commit은 호출자가)."""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    with conn.cursor() as cur:
+        cur.copy_expert(
+            """
+            COPY prices (ticker, trade_date, open, high, low, close, adj_close, volume)
+            FROM STDIN WITH (FORMAT csv)
+            """,
+            buf,
+        )
+
+
+def price_rows(ticker: str, df: pd.DataFrame) -> List[tuple]:
+    """다운로드 DataFrame → prices 테이블 행 (정규화 + NaN 행 스킵)."""
     if df is None or df.empty:
-        return
+        return []
 
     df = normalize_ohlcv_columns(df, ticker)
     if df is None or df.empty:
         print(f"[WARN] {ticker}: unable to normalize columns. skipped.")
-        return
+        return []
 
+    # NaN/inf 행은 컬럼 단위로 한 번에 제거 (0으로 넣지 않음)
     df = df.dropna(how="any")
-
-    rows = []
-    for idx, row in df.iterrows():
-        trade_date = idx.date()
-        open_ = safe_float(row["Open"])
-        high_ = safe_float(row["High"])
-        low_ = safe_float(row["Low"])
-        close_ = safe_float(row["Close"])
-        adjc_ = safe_float(row["Adj Close"])
-        vol_ = safe_int(row["Volume"])
-        if None in (open_, high_, low_, close_, adjc_, vol_):
-            continue
-        rows.append((ticker, trade_date, open_, high_, low_, close_, adjc_, vol_))
+    df = df[np.isfinite(df[OHLCV_COLS].to_numpy(dtype=np.float64)).all(axis=1)]
+
+    dates = pd.DatetimeIndex(df.index).date  # datetime.date 배열 (한 번에 변환)
+    rows = list(zip(
+        [ticker] * len(df),
+        dates,
+        df["Open"].tolist(),
+        df["High"].tolist(),
+        df["Low"].tolist(),
+        df["Close"].tolist(),
+        df["Adj Close"].tolist(),
+        df["Volume"].astype("int64").tolist(),
+    ))
 
     if not rows:
         print(f"[WARN] {ticker}: no valid rows after cleaning. skipped.")
+    return rows
+
+
+def write_prices(conn, rows: List[tuple], is_new: bool = False):
+    """
+    prices 테이블 대량 업서트 (commit은 호출자가).
+    - is_new=True: DB에 없는 티커만 포함 → ON CONFLICT 없이 COPY로 적재
+    """
+    if not rows:
+        return
+
+    if is_new:
+        copy_prices(conn, rows)
         return
 
     with conn.cursor() as cur:
-        execute_batch(
+        execute_values(
             cur,
             """
             INSERT INTO prices (ticker, trade_date, open, high, low, close, adj_close, volume)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+            VALUES %s
             ON CONFLICT (ticker, trade_date) DO UPDATE SET
               open=EXCLUDED.open,
               high=EXCLUDED.high,
@@ -268,9 +297,147 @@ def upsert_prices(conn, ticker: str, df: pd.DataFrame):
               volume=EXCLUDED.volume;
             """,
             rows,
-            page_size=1000,
+            page_size=10000,
         )
-    conn.commit()
+
+
+def download_chunk(chunk: List[str]) -> List[tuple]:
+    """
+    티커 묶음을 한 번에 다운로드 (워커 스레드에서 실행).
+    yf.download 배치 + yf.Tickers 세션 공유로 티커마다 HTTPS 연결을 새로 열지 않음.
+    반환: [(ticker, df 또는 None, info), ...]
+    """
+    try:
+        data = yf.download(
+            chunk,
+            period="18mo",  # 300거래일 (약 1.5년)
+            interval="1d",
+            auto_adjust=True,
+            progress=False,
+            group_by="ticker",
+            threads=True,
+        )
+    except Exception as e:
+        print(f"[ERROR] {chunk[0]}..{chunk[-1]}: download failed: {e}")
+        return [(t, None, {}) for t in chunk]
+
+    try:
+        handles = yf.Tickers(" ".join(chunk)).tickers
+    except Exception:
+        handles = {}
+
+    out = []
+    for t in chunk:
+        if data is None or data.empty:
+            df = None
+        elif isinstance(data.columns, pd.MultiIndex):
+            df = data[t].dropna(how="all") if t in data.columns.get_level_values(0) else None
+        else:
+            df = data
+
+        # 종목 메타 (실패 무시)
+        try:
+            info = handles[t].info
+        except Exception:
+            info = {}
+        out.append((t, df, info))
+    return out
+
+
+def price_writer(conn, q: queue.Queue, is_new: bool, lost: List[str]):
+    """
+    단일 writer 스레드: 큐에서 (ticker, df, info)를 받아 행을 누적하고
+    WRITE_BATCH_ROWS마다 stocks → prices 순서로 배치 적재 (FK 순서 보장).
+    commit은 COMMIT_EVERY 티커마다 + 마지막에 한 번, 실패한 배치는 savepoint로 그 배치만 되돌림.
+    적재되지 못한 티커는 lost에 기록, 예외로 종료되면 producer는 is_alive()로 감지.
+    """
+    meta_rows, rows = [], []
+    batch: List[str] = []        # 현재 배치의 티커
+    uncommitted: List[str] = []  # 마지막 commit 이후 적재된 티커
+
+    def rollback_all(reason: str):
+        # 트랜잭션 전체 롤백 → commit 안 된 이전 배치도 모두 사라지므로 기록 후 초기화
+        print(f"[ERROR] {reason} → rolled back {len(uncommitted)} uncommitted tickers: "
+              f"{', '.join(uncommitted[:20])}{' ...' if len(uncommitted) > 20 else ''}")
+        lost.extend(uncommitted)
+        uncommitted.clear()
+        conn.rollback()
+
+    def commit():
+        try:
+            conn.commit()
+        except Exception as e:
+            rollback_all(f"commit failed: {e}")
+            return
+        uncommitted.clear()
+
+    def flush():
+        if not meta_rows and not rows:
+            return
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SAVEPOINT flush_batch;")
+            upsert_stock_meta_batch(conn, meta_rows)
+            write_prices(conn, rows, is_new=is_new)
+            uncommitted.extend(batch)
+            print(f"[OK] flushed {len(meta_rows)} tickers / {len(rows)} rows")
+        except Exception as e:
+            print(f"[ERROR] flush failed ({len(meta_rows)} tickers): {e}")
+            lost.extend(batch)
+            batch.clear()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("ROLLBACK TO SAVEPOINT flush_batch;")
+            except Exception as e2:
+                rollback_all(f"savepoint rollback failed: {e2}")
+        meta_rows.clear()
+        rows.clear()
+        batch.clear()
+        if len(uncommitted) >= COMMIT_EVERY:
+            commit()
+
+    try:
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            t, df, info = item
+            if df is None or df.empty:
+                print(f"[WARN] {t}: empty DataFrame (skip)")
+                continue
+
+            # 디버그: 컬럼 확인
+            print("[DEBUG]", t, "columns:", list(df.columns)[:6])
+
+            r = price_rows(t, df)
+            if not r:
+                continue
+            meta_rows.append(stock_meta_row(t, info))
+            batch.append(t)
+            rows.extend(r)
+            if len(rows) >= WRITE_BATCH_ROWS:
+                flush()
+        flush()
+        commit()
+    except Exception as e:
+        # 연결 끊김 등: 남은 작업은 버리고 종료 (producer는 is_alive()로 감지)
+        print(f"[ERROR] writer stopped: {e}")
+        lost.extend(uncommitted + batch)
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+
+
+def enqueue(q: queue.Queue, item, writer: threading.Thread) -> bool:
+    """writer가 살아 있는 동안만 put (writer가 죽으면 가득 찬 큐에서 영원히 막히지 않도록)."""
+    while writer.is_alive():
+        try:
+            q.put(item, timeout=1.0)
+            return True
+        except queue.Full:
+            continue
+    return False
 
 
 def main():
@@ -301,38 +468,32 @@ def main():
         conn.close()
         return
 
-    # 다운로드 & 업서트
-    for idx, t in enumerate(tickers, 1):
-        print(f"[{idx}/{len(tickers)}] Downloading {t}…")
-        df = yf.download(
-            t,
-            period="18mo",  # 300거래일 (약 1.5년)
-            interval="1d",
-            auto_adjust=True,
-            progress=False,
-            group_by="column",
-            threads=False,
-        )
-        if df is None or df.empty:
-            print(f"[WARN] {t}: empty DataFrame (skip)")
-            continue
-
-        # 디버그: 컬럼 확인
-        print("[DEBUG]", t, "columns:", list(df.columns)[:6])
-
-        # 종목 메타 (실패 무시)
-        try:
-            info = yf.Ticker(t).info
-        except Exception:
-            info = {}
-
-        try:
-            upsert_stock_meta(conn, t, info)
-            upsert_prices(conn, t, df)
-            print(f"[OK] {t}: {len(df)} rows processed.")
-        except Exception as e:
-            print(f"[ERROR] {t}: {e}")
+    # 다운로드(스레드 풀) & 업서트(단일 writer 스레드)
+    q: queue.Queue = queue.Queue(maxsize=DOWNLOAD_WORKERS * 4)
+    lost: List[str] = []
+    writer = threading.Thread(target=price_writer, args=(conn, q, True, lost))
+    writer.start()
 
+    try:
+        chunks = [tickers[i:i + DOWNLOAD_CHUNK] for i in range(0, len(tickers), DOWNLOAD_CHUNK)]
+        done = 0
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            futures = [pool.submit(download_chunk, c) for c in chunks]
+            for fut in as_completed(futures):
+                results = fut.result()
+                done += len(results)
+                print(f"[{done}/{len(tickers)}] Downloaded {results[0][0]}..{results[-1][0]}")
+                if not all(enqueue(q, item, writer) for item in results):
+                    print("[ERROR] writer thread stopped; cancelling remaining downloads")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    break
+    finally:
+        enqueue(q, None, writer)
+        writer.join()
+
+    if lost:
+        print(f"[WARN] {len(lost)} tickers were not stored (rerun to retry): "
+              f"{', '.join(lost[:50])}{' ...' if len(lost) > 50 else ''}")
     conn.close()
     print("Done.")
 
@@ -37,6 +37,7 @@ CREATE TABLE IF NOT EXISTS graph_segments (
     segment_start DATE NOT NULL,
     segment_end DATE,
     vector vector(128),  -- pgvector 128차원 벡터
+    vector_bin BYTEA,    -- 같은 벡터의 little-endian float32 바이너리 (512 bytes, 빠른 역직렬화용)
     volatility REAL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (ticker) REFERENCES stocks(ticker) ON DELETE CASCADE
@@ -48,6 +49,11 @@ CREATE INDEX IF NOT EXISTS idx_prices_date ON prices(trade_date);
 CREATE INDEX IF NOT EXISTS idx_segments_ticker ON graph_segments(ticker);
 CREATE INDEX IF NOT EXISTS idx_segments_ma_type ON graph_segments(ma_type);
 
+-- 티커별 최신 세그먼트 조회(DISTINCT ON (ticker) ... ORDER BY ticker, segment_end DESC)용 커버링 인덱스
+CREATE INDEX IF NOT EXISTS graph_segments_ma_ticker_end_idx
+    ON graph_segments (ma_type, ticker, segment_end DESC)
+    INCLUDE (vector, vector_bin, volatility, segment_start, id);
+
 -- 백터 검색을 위한 HNSW 인덱스 생성
 CREATE INDEX IF NOT EXISTS idx_segments_vector_cosine ON graph_segments USING hnsw (vector vector_cosine_ops);
 
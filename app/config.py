@@ -22,6 +22,7 @@ class Settings(BaseSettings):
     target_len: int = 128
     cache_ttl_sec: int = 86400  # 24 hours
     max_tickers: int = 5000
+    similar_cache_size: int = 256  # /similar 응답 LRU 캐시 크기
 
     # Rate Limiting
     rate_limit_ingest: str = "5/minute"
@@ -1,8 +1,11 @@
 import yfinance as yf
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import logging
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import time, json
 
 logger = logging.getLogger(__name__)
@@ -58,15 +61,35 @@ def compute_ma20(ohlc_multi: pd.DataFrame) -> Dict[str, pd.Series]:
     Returns:
         {ticker: MA20 Series} 딕셔너리
     """
+    # 멀티컬럼: (Ticker, Field) → Close만 (날짜 × 티커) 2D로 뽑아 한 번에 rolling
+    if "Close" not in ohlc_multi.columns.get_level_values(1):
+        logger.info("MA20 calculated for 0 tickers")
+        return {}
+    close = ohlc_multi.xs("Close", axis=1, level=1, drop_level=True)
+
+    counts = close.count()
+    for t in counts.index[counts < MIN_MA_POINTS]:
+        logger.warning(f"Ticker {t} has insufficient data ({counts[t]} < {MIN_MA_POINTS}), skipping")
+    close = close.loc[:, counts >= MIN_MA_POINTS]
+    if close.shape[1] == 0:
+        logger.info("MA20 calculated for 0 tickers")
+        return {}
+
+    # 내부 결측(gap)이 있는 티커: 다른 티커의 거래일 때문에 생긴 빈 날도 윈도우에 들어가면
+    # MA 20개가 통째로 사라지므로, 기존처럼 결측을 제거한 뒤 티커별로 rolling (관측치 기준 MA)
+    notna = close.notna().to_numpy()
+    first = notna.argmax(axis=0)
+    last = len(notna) - 1 - notna[::-1].argmax(axis=0)
+    gapped = notna.sum(axis=0) != (last - first + 1)
+
+    # 앞뒤 결측만 있는 티커는 한 번의 2D rolling으로 동일한 결과
+    ma_df = close.loc[:, ~gapped].rolling(MA_WINDOW, min_periods=MA_WINDOW).mean()
     out = {}
-    # 멀티컬럼: (Ticker, Field)
-    for t in ohlc_multi.columns.levels[0]:
-        if (t, 'Close') in ohlc_multi.columns:
-            s = ohlc_multi[(t, 'Close')].dropna()
-            if len(s) >= MIN_MA_POINTS:
-                out[t] = s.rolling(MA_WINDOW).mean().dropna()
-            else:
-                logger.warning(f"Ticker {t} has insufficient data ({len(s)} < {MIN_MA_POINTS}), skipping")
+    for t, has_gap in zip(close.columns, gapped):
+        if has_gap:
+            out[t] = close[t].dropna().rolling(MA_WINDOW).mean().dropna()
+        else:
+            out[t] = ma_df[t].dropna()
 
     logger.info(f"MA20 calculated for {len(out)} tickers")
     return out
@@ -87,10 +110,64 @@ def save_ma20_parquet(ma_dict: Dict[str, pd.Series]) -> str:
     logger.info(f"Saved MA20 data to {p}: {df.shape}")
     return str(p)
 
+def _matrix_path(target_len: int) -> Path:
+    """정규화 매트릭스 Parquet 경로 (target_len별로 분리)"""
+    return DATA_DIR / f"ma20_norm_{target_len}.parquet"
+
+def save_matrix_parquet(matrix: np.ndarray, tickers: List[str]) -> str:
+    """
+    정규화 매트릭스를 Parquet 파일로 저장 (ticker, vector: float32 고정 길이 리스트)
+
+    Args:
+        matrix: (N × target_len) 정규화 매트릭스
+        tickers: 각 행에 대응하는 티커 심볼
+
+    Returns:
+        저장된 파일 경로
+    """
+    target_len = matrix.shape[1]
+    flat = pa.array(np.ascontiguousarray(matrix, dtype=np.float32).ravel(), type=pa.float32())
+    table = pa.table({
+        "ticker": pa.array(tickers, type=pa.string()),
+        "vector": pa.FixedSizeListArray.from_arrays(flat, target_len),
+    })
+    p = _matrix_path(target_len)
+    pq.write_table(table, p)
+    logger.info(f"Saved normalized matrix to {p}: {matrix.shape}")
+    return str(p)
+
+def load_matrix_parquet(target_len: int) -> Optional[Tuple[np.ndarray, List[str]]]:
+    """
+    save_matrix_parquet로 저장한 정규화 매트릭스 로드 (리샘플링/정규화 재계산 없음)
+
+    Args:
+        target_len: 매트릭스 열 길이
+
+    Returns:
+        (float32 매트릭스, 티커 리스트) 또는 None (파일 없음/MA20 데이터보다 오래됨)
+    """
+    p = _matrix_path(target_len)
+    if not p.exists():
+        logger.debug(f"No normalized matrix found at {p}")
+        return None
+
+    src = DATA_DIR / "ma20.parquet"
+    if src.exists() and src.stat().st_mtime > p.stat().st_mtime:
+        logger.info(f"Normalized matrix {p} is older than {src}, ignoring")
+        return None
+
+    table = pq.read_table(p)
+    vectors = table.column("vector").combine_chunks()
+    matrix = vectors.flatten().to_numpy(zero_copy_only=False).reshape(-1, target_len)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    tickers = table.column("ticker").to_pylist()
+    logger.debug(f"Loaded normalized matrix from {p}: {matrix.shape}")
+    return matrix, tickers
+
 def save_meta(meta: dict) -> None:
     """메타데이터를 JSON 파일로 저장"""
     path = DATA_DIR / "meta.json"
-    path.write_text(json.dumps(meta, indent=2))
+    path.write_bytes(json.dumps(meta, indent=2).encode())
     logger.debug(f"Saved metadata to {path}")
 
 def load_ma20_parquet() -> Optional[pd.DataFrame]:
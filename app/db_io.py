@@ -4,17 +4,76 @@ Provides connection management and vector retrieval from graph_segments table
 """
 import os
 import logging
+from functools import lru_cache
 from typing import List, Tuple, Optional
 import numpy as np
 import psycopg2
+import psycopg2.extensions
 from psycopg2.pool import SimpleConnectionPool
 from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
 
+# Segment vector length (build_segments.OUT_LEN)
+VECTOR_DIM = 128
+
+# Rows per network round trip when streaming segments through a server-side cursor
+STREAM_ITERSIZE = 1000
+
+# Initial buffer rows for latest_only fetches (one row per ticker; grows if exceeded)
+LATEST_INITIAL_ROWS = 8192
+
 # Connection pool (initialized on first use)
 _pool: Optional[SimpleConnectionPool] = None
 
+# Prepared statements created once per pooled connection (skips parse/plan per request)
+_PREPARE_LATEST_MA20 = """
+    PREPARE get_latest_ma20(text[], int) AS
+    SELECT DISTINCT ON (ticker)
+        ticker,
+        vector,
+        segment_end
+    FROM graph_segments
+    WHERE ticker = ANY($1[1:$2]) AND ma_type = 'MA20'
+    ORDER BY ticker, segment_end DESC;
+"""
+
+
+def _cast_pgvector(value, cur):
+    """Typecaster for pgvector's text form '[1.0,2.0,...]' → float32 ndarray"""
+    if value is None:
+        return None
+    return np.fromstring(value[1:-1], sep=",", dtype=np.float32)
+
+
+def _register_vector_type(conn):
+    """Register the pgvector typecaster on a connection (no-op if the extension is missing)"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT oid FROM pg_type WHERE typname = 'vector';")
+        row = cur.fetchone()
+    if row is not None:
+        vector_type = psycopg2.extensions.new_type((row[0],), "VECTOR", _cast_pgvector)
+        psycopg2.extensions.register_type(vector_type, conn)
+
+
+def _as_vector(value) -> np.ndarray:
+    """DB vector value (float[] list or typecast pgvector) → float32 ndarray"""
+    if isinstance(value, str):
+        raise TypeError("Unexpected text vector from database; vector typecaster not registered")
+    return np.asarray(value, dtype=np.float32)
+
+
+class PreparingConnectionPool(SimpleConnectionPool):
+    """SimpleConnectionPool that registers typecasters and PREPAREs hot-path queries on every new connection"""
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        _register_vector_type(conn)
+        with conn.cursor() as cur:
+            cur.execute(_PREPARE_LATEST_MA20)
+        conn.commit()
+        return conn
+
 
 def init_pool(host: str, port: int, database: str, user: str, password: str, minconn: int = 1, maxconn: int = 10):
     """Initialize PostgreSQL connection pool"""
@@ -22,7 +81,7 @@ def init_pool(host: str, port: int, database: str, user: str, password: str, min
     if _pool is None:
         try:
             # Render PostgreSQL requires SSL but skip certificate verification
-            _pool = SimpleConnectionPool(
+            _pool = PreparingConnectionPool(
                 minconn,
                 maxconn,
                 host=host,
@@ -52,29 +111,53 @@ def get_connection():
         _pool.putconn(conn)
 
 
-def fetch_all_segments(ma_type: str = "MA20", latest_only: bool = False) -> Tuple[np.ndarray, List[str], List[dict]]:
+def fetch_all_segments(ma_type: str = "MA20", latest_only: bool = False,
+                       binary: bool = True) -> Tuple[np.ndarray, List[str], List[dict]]:
     """
     Fetch all pre-computed vector segments from graph_segments table
 
     Args:
         ma_type: Moving average type (default "MA20")
         latest_only: If True, fetch only the latest segment per ticker (much faster!)
+        binary: If True, read the float32 BYTEA column (vector_bin) and fall back to the
+            array column (vector) only for rows where vector_bin is NULL (e.g. segments
+            built before the column existed); set False for tables without vector_bin
 
     Returns:
         Tuple of:
         - vectors: numpy array of shape (N, 128) - all segment vectors
         - tickers: list of ticker symbols for each segment
         - metadata: list of dicts with segment info (id, start_date, end_date, volatility)
+
+    The most recent result is cached in-process and reused until the table's segment
+    version (count, max id) changes, so repeated calls cost one small aggregate query.
+    Only one entry is kept, so a stale full-table matrix is released as soon as the
+    next version is loaded.
+    The returned objects are shared between callers; do not mutate them.
     """
+    version = _segment_version(ma_type)
+    return _fetch_all_segments_cached(ma_type, latest_only, binary, version)
+
+
+@lru_cache(maxsize=1)  # single slot: a new version replaces (frees) the old matrix
+def _fetch_all_segments_cached(ma_type: str, latest_only: bool, binary: bool,
+                               version: Tuple[int, int]) -> Tuple[np.ndarray, List[str], List[dict]]:
+    """Uncached body of fetch_all_segments (version only participates in the cache key)"""
+    if binary:
+        # vector is only shipped for rows that have no vector_bin yet
+        vector_cols = "vector_bin, CASE WHEN vector_bin IS NULL THEN vector END AS vector"
+    else:
+        vector_cols = "NULL::bytea AS vector_bin, vector"
+
     if latest_only:
         # 티커당 최신 세그먼트만 (DISTINCT ON 사용)
-        query = """
+        query = f"""
             SELECT DISTINCT ON (ticker)
                 id,
                 ticker,
                 segment_start,
                 segment_end,
-                vector,
+                {vector_cols},
                 volatility
             FROM graph_segments
             WHERE ma_type = %s
@@ -82,13 +165,13 @@ def fetch_all_segments(ma_type: str = "MA20", latest_only: bool = False) -> Tupl
         """
     else:
         # 모든 세그먼트 (기존 방식)
-        query = """
+        query = f"""
             SELECT
                 id,
                 ticker,
                 segment_start,
                 segment_end,
-                vector,
+                {vector_cols},
                 volatility
             FROM graph_segments
             WHERE ma_type = %s
@@ -99,46 +182,64 @@ def fetch_all_segments(ma_type: str = "MA20", latest_only: bool = False) -> Tupl
     logger.info(f"   {query.strip()}")
     logger.info(f"   Parameters: ma_type='{ma_type}'")
 
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            import time
-            start_time = time.time()
-            cur.execute(query, (ma_type,))
-            rows = cur.fetchall()
-            elapsed = time.time() - start_time
-            logger.info(f"✅ Query executed in {elapsed:.3f}s, fetched {len(rows)} rows")
-
-    if not rows:
-        logger.warning(f"No segments found for ma_type={ma_type}")
-        return np.array([]), [], []
-
-    vectors = []
+    # Full fetches size the buffer from the version key's row count; latest_only returns
+    # one row per ticker, so it starts small and grows instead of reserving the whole table
+    capacity = max(min(version[0], LATEST_INITIAL_ROWS) if latest_only else version[0], 1)
+    vectors_array = np.empty((capacity, VECTOR_DIM), dtype=np.float32)
     tickers = []
     metadata = []
+    n = 0
 
-    for row in rows:
-        seg_id, ticker, start_date, end_date, vector, volatility = row
+    with get_connection() as conn:
+        try:
+            # Named (server-side) cursor: rows arrive in itersize batches and are decoded
+            # straight into the preallocated buffer instead of a full fetchall() list
+            with conn.cursor(name="fetch_all_segments") as cur:
+                import time
+                start_time = time.time()
+                cur.itersize = STREAM_ITERSIZE
+                cur.execute(query, (ma_type,))
+
+                for seg_id, ticker, start_date, end_date, vector_bin, vector, volatility in cur:
+                    if n == capacity:
+                        # More rows than reserved (latest_only, or inserts after the version check)
+                        capacity *= 2
+                        vectors_array = np.resize(vectors_array, (capacity, VECTOR_DIM))
+
+                    if vector_bin is not None:
+                        # BYTEA (memoryview) → float32 without per-element boxing
+                        vectors_array[n] = np.frombuffer(vector_bin, dtype="<f4")
+                    else:
+                        vectors_array[n] = _as_vector(vector)
+
+                    tickers.append(ticker)
+                    metadata.append({
+                        'id': seg_id,
+                        'ticker': ticker,
+                        'start_date': start_date,
+                        'end_date': end_date,
+                        'volatility': volatility
+                    })
+                    n += 1
+
+                elapsed = time.time() - start_time
+                logger.info(f"✅ Query executed in {elapsed:.3f}s, fetched {n} rows")
+        finally:
+            # Close the read transaction (and the named cursor) even if iteration failed
+            conn.rollback()
+
+    if n == 0:
+        logger.warning(f"No segments found for ma_type={ma_type}")
+        return np.array([]), [], []
 
-        # Convert PostgreSQL array to numpy array
-        if isinstance(vector, list):
-            vec = np.array(vector, dtype=np.float32)
-        else:
-            # Handle potential string representation
-            vec = np.array(eval(vector) if isinstance(vector, str) else vector, dtype=np.float32)
+    if n < capacity:
+        vectors_array = vectors_array[:n].copy()
 
-        vectors.append(vec)
-        tickers.append(ticker)
-        metadata.append({
-            'id': seg_id,
-            'ticker': ticker,
-            'start_date': start_date,
-            'end_date': end_date,
-            'volatility': volatility
-        })
+    vectors_array.setflags(write=False)  # shared through the cache
 
-    vectors_array = np.vstack(vectors)  # Shape: (N, 128)
+    logger.info(f"Loaded {len(tickers)} segments from database (ma_type={ma_type})")
+    return vectors_array, tickers, metadata
 
-    logger.info(f"Loaded {len(vectors)} segments from database (ma_type={ma_type})")
 
 def fetch_top_k_segments(sketch_vec: np.ndarray, ma_type: str = "MA20", limit: int = 100) -> Tuple[np.ndarray, List[str], List[dict]]:
     """
@@ -151,7 +252,7 @@ def fetch_top_k_segments(sketch_vec: np.ndarray, ma_type: str = "MA20", limit: i
     
     Returns:
         Tuple of:
-        - vectors: numpy array of shape (N, 128) - retrieved segment vectors
+        - vectors: C-contiguous float32 array of shape (N, 128) - retrieved segment vectors
         - tickers: list of ticker symbols for each segment
         - metadata: list of dicts with segment info
     """
@@ -190,26 +291,17 @@ def fetch_top_k_segments(sketch_vec: np.ndarray, ma_type: str = "MA20", limit: i
 
     if not rows:
         logger.warning(f"No segments found for ma_type={ma_type}")
-        return np.array([]), [], []
+        return np.empty((0, VECTOR_DIM), dtype=np.float32), [], []
 
-    vectors = []
+    # Copy each row straight into a preallocated C-order float32 (N, 128) buffer
+    vectors_array = np.empty((len(rows), VECTOR_DIM), dtype=np.float32)
     tickers = []
     metadata = []
 
-    for row in rows:
+    for i, row in enumerate(rows):
         seg_id, ticker, start_date, end_date, vector, volatility, distance = row
 
-        # Convert PostgreSQL vector (string representation returned by pgvector) to numpy array
-        if isinstance(vector, list):
-            vec = np.array(vector, dtype=np.float32)
-        elif isinstance(vector, str):
-            # pgvector returns string '[1.0,2.0,...]' 
-            clean_str = vector.replace('[', '').replace(']', '')
-            vec = np.array([float(x) for x in clean_str.split(',')], dtype=np.float32)
-        else:
-            vec = np.array(vector, dtype=np.float32)
-
-        vectors.append(vec)
+        np.copyto(vectors_array[i], _as_vector(vector))
         tickers.append(ticker)
         metadata.append({
             'id': seg_id,
@@ -220,8 +312,6 @@ def fetch_top_k_segments(sketch_vec: np.ndarray, ma_type: str = "MA20", limit: i
             'pgvector_distance': float(distance)
         })
 
-    vectors_array = np.vstack(vectors)  # Shape: (N, 128)
-
     return vectors_array, tickers, metadata
 
 
@@ -239,15 +329,8 @@ def fetch_latest_ma20_for_tickers(tickers: List[str], limit: int = 5) -> dict:
     if not tickers:
         return {}
 
-    query = """
-        SELECT DISTINCT ON (ticker)
-            ticker,
-            vector,
-            segment_end
-        FROM graph_segments
-        WHERE ticker = ANY(%s) AND ma_type = 'MA20'
-        ORDER BY ticker, segment_end DESC;
-    """
+    # Prepared per connection in PreparingConnectionPool; limit is applied in SQL
+    query = "EXECUTE get_latest_ma20(%s::text[], %s);"
 
     logger.info(f"🔍 Executing SQL Query: fetch_latest_ma20_for_tickers")
     logger.info(f"   Tickers: {tickers[:limit]} (limit: {limit})")
@@ -256,22 +339,30 @@ def fetch_latest_ma20_for_tickers(tickers: List[str], limit: int = 5) -> dict:
         with conn.cursor() as cur:
             import time
             start_time = time.time()
-            cur.execute(query, (tickers[:limit],))
+            cur.execute(query, (list(tickers), limit))
             rows = cur.fetchall()
             elapsed = time.time() - start_time
             logger.info(f"✅ Query executed in {elapsed:.3f}s, fetched {len(rows)} rows")
 
     result = {}
     for ticker, vector, end_date in rows:
-        if isinstance(vector, list):
-            vec = np.array(vector, dtype=np.float32)
-        else:
-            vec = np.array(eval(vector) if isinstance(vector, str) else vector, dtype=np.float32)
-        result[ticker] = vec
+        result[ticker] = _as_vector(vector)
 
     return result
 
 
+def _segment_version(ma_type: str) -> Tuple[int, int]:
+    """(count, max id) of segments - changes whenever rows are inserted or rebuilt"""
+    query = "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM graph_segments WHERE ma_type = %s;"
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, (ma_type,))
+            count, max_id = cur.fetchone()
+
+    return count, max_id
+
+
 def get_segment_count() -> int:
     """Get total number of segments in database"""
     query = "SELECT COUNT(*) FROM graph_segments WHERE ma_type = 'MA20';"
@@ -1,14 +1,38 @@
 import numpy as np
 import pandas as pd
 import logging
+from collections import defaultdict
+from functools import lru_cache
 from typing import Dict, Tuple, List
 
 logger = logging.getLogger(__name__)
 
+# numba가 있으면 배치 리샘플+정규화 커널을 JIT 컴파일, 없으면 NumPy 경로 사용
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 # Constants
 MIN_DATA_POINTS = 30  # dict_to_matrix에서 필터링할 최소 데이터 포인트
 ZSCORE_EPSILON = 1e-8  # Z-score 계산 시 division by zero 방지
 
+@lru_cache(maxsize=64)
+def _interp_weights(n_old: int, n_new: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    선형 보간 가중치 (lo, hi, frac) - (입력 길이, 목표 길이) 별로 캐싱
+
+    y_new = y[lo] * (1 - frac) + y[hi] * frac
+    """
+    idx = np.linspace(0, n_old - 1, num=n_new)
+    lo = np.floor(idx).astype(np.int64)
+    hi = np.clip(lo + 1, 0, n_old - 1)
+    frac = idx - lo
+    for a in (lo, hi, frac):
+        a.setflags(write=False)  # 캐시 공유 배열 보호
+    return lo, hi, frac
+
 def resample_series(y: np.ndarray, target_len: int) -> np.ndarray:
     """
     시계열을 고정 길이로 리샘플링 (선형 보간)
@@ -20,23 +44,47 @@ def resample_series(y: np.ndarray, target_len: int) -> np.ndarray:
     Returns:
         리샘플링된 시계열 (target_len 길이)
     """
-    x_old = np.linspace(0, 1, num=len(y))
-    x_new = np.linspace(0, 1, num=target_len)
-    return np.interp(x_new, x_old, y)
+    n = len(y)
+    if n == target_len:
+        return y  # 보간 불필요
+    if target_len > 1 and n > target_len and (n - 1) % (target_len - 1) == 0:
+        return y[::(n - 1) // (target_len - 1)]  # 정수 간격 → 보간 없이 샘플링
+    lo, hi, frac = _interp_weights(n, target_len)
+    return y[lo] * (1 - frac) + y[hi] * frac
 
-def zscore(y: np.ndarray, eps: float = ZSCORE_EPSILON) -> np.ndarray:
+def resample_matrix(Y: np.ndarray, target_len: int) -> np.ndarray:
+    """
+    같은 길이의 시계열 여러 개를 한 번에 리샘플링 (행 단위, resample_series와 동일)
+
+    Args:
+        Y: (K × n) 입력 시계열
+        target_len: 목표 길이
+
+    Returns:
+        (K × target_len) 리샘플링 결과
+    """
+    n = Y.shape[1]
+    if n == target_len:
+        return Y
+    if target_len > 1 and n > target_len and (n - 1) % (target_len - 1) == 0:
+        return Y[:, ::(n - 1) // (target_len - 1)]
+    lo, hi, frac = _interp_weights(n, target_len)
+    return Y[:, lo] * (1 - frac) + Y[:, hi] * frac
+
+def zscore(y: np.ndarray, eps: float = ZSCORE_EPSILON, nan_safe: bool = True) -> np.ndarray:
     """
     Z-score 정규화 (평균=0, 표준편차=1) - NaN 안전
 
     Args:
         y: 입력 시계열
         eps: 표준편차가 0일 때 사용할 최소값
+        nan_safe: False면 NaN 검사/대체 생략 (호출자가 NaN 없음을 보장할 때)
 
     Returns:
         정규화된 시계열 (NaN 제거됨)
     """
     # NaN 제거
-    if np.any(np.isnan(y)):
+    if nan_safe and np.any(np.isnan(y)):
         logger.warning(f"NaN detected in zscore input, replacing with mean")
         # NaN을 평균으로 대체
         mask = np.isnan(y)
@@ -53,15 +101,42 @@ def zscore(y: np.ndarray, eps: float = ZSCORE_EPSILON) -> np.ndarray:
         logger.debug(f"Low variance detected (std={std}), returning zero-centered array")
         return y - mu  # 평균만 빼고 스케일링 안 함
 
-    result = (y - mu) / std
+    result = y - mu
+    result /= std
 
     # 최종 NaN 체크
-    if np.any(np.isnan(result)):
+    if nan_safe and np.any(np.isnan(result)):
         logger.error("NaN in zscore output, replacing with zeros")
         result = np.nan_to_num(result, nan=0.0)
 
     return result
 
+def zscore_matrix(M: np.ndarray, eps: float = ZSCORE_EPSILON, nan_safe: bool = True) -> np.ndarray:
+    """
+    행 단위 Z-score 정규화 (zscore를 매트릭스 전체에 한 번에 적용) - NaN 안전
+
+    Args:
+        M: (N × L) 입력 매트릭스
+        eps: 표준편차가 이보다 작으면 평균만 빼고 스케일링 안 함
+        nan_safe: False면 NaN 검사/대체 생략 (호출자가 NaN 없음을 보장할 때)
+
+    Returns:
+        정규화된 (N × L) 매트릭스 (NaN 제거됨)
+    """
+    nan_mask = np.isnan(M) if nan_safe else None
+    if nan_safe and nan_mask.any():
+        logger.warning(f"NaN detected in zscore_matrix input ({int(nan_mask.any(axis=1).sum())} rows), replacing with row mean")
+        with np.errstate(invalid="ignore"):
+            row_mean = np.nanmean(np.where(nan_mask.all(axis=1, keepdims=True), 0.0, M), axis=1, keepdims=True)
+        # 모든 값이 NaN인 행은 0으로 (zscore와 동일)
+        M = np.where(nan_mask, row_mean, M)
+
+    mu = M.mean(axis=1, keepdims=True)
+    std = M.std(axis=1, keepdims=True)
+    result = M - mu
+    result /= np.where(std < eps, 1.0, std)
+    return result
+
 def normalize_pipeline(y: np.ndarray, target_len: int) -> np.ndarray:
     """
     정규화 파이프라인: 리샘플링 → Z-score 정규화
@@ -73,38 +148,118 @@ def normalize_pipeline(y: np.ndarray, target_len: int) -> np.ndarray:
     Returns:
         정규화된 시계열
     """
+    y = np.asarray(y, dtype=np.float64)
+    has_nan = bool(np.isnan(y).any())  # NaN 검사는 입력에 대해 한 번만
+    # NaN이 없으면 리샘플링 + 정규화를 한 번의 커널 호출로 처리
+    if NUMBA_AVAILABLE and len(y) > 0 and not has_nan:
+        out = np.empty(target_len, dtype=np.float64)
+        _resample_zscore(y, out, ZSCORE_EPSILON)
+        return out
     y = resample_series(y, target_len)
-    y = zscore(y)
+    y = zscore(y, nan_safe=has_nan)
     return y
 
+if NUMBA_AVAILABLE:
+    @njit(cache=True, fastmath=True, nogil=True)
+    def _resample_zscore(y, out, eps):
+        """
+        리샘플링 + Z-score 융합 커널 (normalize_pipeline과 동일한 결과, NaN 없는 입력 전제)
+
+        1패스: 선형 보간 값을 out에 쓰면서 Welford로 평균/분산 누적
+        2패스: out을 제자리에서 (x - mu) / std
+
+        Args:
+            y: 입력 시계열 (길이 >= 1)
+            out: (target_len,) 출력 버퍼
+            eps: 표준편차 하한 (미만이면 평균만 제거)
+        """
+        n = y.shape[0]
+        m = out.shape[0]
+        scale = (n - 1) / (m - 1) if m > 1 else 0.0
+
+        mu = 0.0
+        m2 = 0.0
+        for j in range(m):
+            x = j * scale
+            lo = min(int(x), n - 1)
+            hi = min(lo + 1, n - 1)
+            f = x - lo
+            v = y[lo] * (1.0 - f) + y[hi] * f
+            out[j] = v
+            d = v - mu
+            mu += d / (j + 1)
+            m2 += d * (v - mu)
+
+        std = np.sqrt(m2 / m)
+        if std >= eps:
+            for j in range(m):
+                out[j] = (out[j] - mu) / std
+        else:
+            for j in range(m):
+                out[j] -= mu
+
+    # parallel=True를 쓰지 않음: workqueue 스레딩 레이어(TBB/OpenMP 미설치 시 기본값)는
+    # 여러 요청 스레드가 동시에 호출하면 프로세스를 중단시킴 (nogil로 요청 간 병렬 처리)
+    @njit(fastmath=True, cache=True, nogil=True)
+    def _resample_zscore_batch(Y, lengths, out, eps):
+        """
+        배치 리샘플링 + Z-score (행마다 _resample_zscore)
+
+        Args:
+            Y: (N, max_len) 패딩된 입력 (행 i는 Y[i, :lengths[i]]만 유효)
+            lengths: 각 행의 유효 길이
+            out: (N, target_len) 출력 버퍼
+            eps: 표준편차 하한 (미만이면 평균만 제거)
+        """
+        for i in range(out.shape[0]):
+            _resample_zscore(Y[i, :lengths[i]], out[i], eps)
+
 def dict_to_matrix(ma_dict: Dict[str, pd.Series], target_len: int) -> Tuple[np.ndarray, List[str]]:
     """
     MA20 딕셔너리를 정규화된 NumPy 매트릭스로 변환
 
     Args:
-        ma_dict: {ticker: MA20 Series} 딕셔너리
+        ma_dict: {ticker: MA20 Series} 딕셔너리 (dropna 완료 - NaN 검사 생략)
         target_len: 리샘플링 목표 길이
 
     Returns:
         (정규화 매트릭스, 티커 리스트) 튜플
-        - 매트릭스: (N tickers × target_len) shape
+        - 매트릭스: (N tickers × target_len) shape, float32 C-contiguous
         - 티커 리스트: 각 행에 대응하는 티커 심볼
     """
-    rows, tickers = [], []
+    series, tickers = [], []
     filtered_count = 0
 
     for t, s in ma_dict.items():
-        y = s.values.astype(float)
+        y = np.asarray(s.values, dtype=np.float32)
         if len(y) < MIN_DATA_POINTS:
             filtered_count += 1
             logger.debug(f"Ticker {t} filtered out: {len(y)} < {MIN_DATA_POINTS} points")
             continue
-        rows.append(normalize_pipeline(y, target_len))
+        series.append(y)
         tickers.append(t)
 
     if filtered_count > 0:
         logger.info(f"Filtered out {filtered_count} tickers with insufficient data")
 
-    matrix = np.vstack(rows)
+    if NUMBA_AVAILABLE and series:
+        # 최대 길이로 한 번만 패딩 후 JIT 커널로 일괄 처리
+        lengths = np.array([len(y) for y in series], dtype=np.int64)
+        Y = np.zeros((len(series), lengths.max()), dtype=np.float32)
+        for i, y in enumerate(series):
+            Y[i, :len(y)] = y
+        matrix = np.empty((len(series), target_len), dtype=np.float32)
+        _resample_zscore_batch(Y, lengths, matrix, ZSCORE_EPSILON)
+    else:
+        # 길이별 버킷마다 보간 가중치를 공유하므로 버킷 단위로 한 번에 리샘플링
+        buckets = defaultdict(list)
+        for i, y in enumerate(series):
+            buckets[len(y)].append(i)
+        matrix = np.empty((len(series), target_len), dtype=np.float32)
+        for rows in buckets.values():
+            resampled = resample_matrix(np.vstack([series[i] for i in rows]), target_len)
+            matrix[rows] = zscore_matrix(resampled, nan_safe=False)  # dropna된 MA20
+    # float32 + C-order: 메모리 대역폭 절반, BLAS SGEMV로 스코어링
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
     logger.info(f"Created matrix: {matrix.shape} ({len(tickers)} tickers × {target_len} points)")
     return matrix, tickers
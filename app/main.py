@@ -1,25 +1,31 @@
 # app/main.py
-from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 import numpy as np, pandas as pd, time
+import hashlib
+import orjson
 import logging
 import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 from .config import settings
-from .models import IngestRequest, SketchRequest, SimilarResponse, SimilarResponseItem
+from .models import IngestRequest, SketchRequest, SimilarResponse
 from .tickers import get_tickers, get_ticker_info
 from .data_io import (
     download_ohlc,  # fallback
     last_n_days, compute_ma20,
-    save_ma20_parquet, save_meta, load_ma20_parquet
+    save_ma20_parquet, save_meta, load_ma20_parquet,
+    save_matrix_parquet, load_matrix_parquet
 )
 from .features import dict_to_matrix, normalize_pipeline
-from .similar import rank_top_k
+from .similar import rank_top_k, dtw_envelopes
 from .ai_analyzer import analyze_sketch_pattern
 from . import db_io
 
@@ -53,16 +59,107 @@ if web_dir.exists():
     app.mount("/web", StaticFiles(directory=str(web_dir)), name="web")
     logger.info(f"Mounted static files from {web_dir}")
 
-# Global cache with thread safety
-CACHE = {
-    "matrix": None,
-    "tickers": None,
-    "target_len": settings.target_len,
-    "norm_map": None,   # ticker -> normalized vector(list)
-    "ticker_info": None,  # ticker -> company name mapping
-}
+@dataclass(frozen=True, slots=True)
+class MatrixCache:
+    """메모리 캐시 스냅샷 (불변) - 갱신 시 새 객체로 통째로 교체"""
+    matrix: Optional[np.ndarray] = None
+    tickers: Tuple[str, ...] = ()
+    ticker_index: Dict[str, int] = field(default_factory=dict)  # ticker -> matrix row index
+    row_norms: Optional[np.ndarray] = None  # matrix row L2 norms (float32)
+    dtw_upper: Optional[np.ndarray] = None  # LB_Keogh upper envelope per row
+    dtw_lower: Optional[np.ndarray] = None  # LB_Keogh lower envelope per row
+    target_len: int = settings.target_len
+    epoch: int = 0  # bumped whenever the matrix changes (invalidates response cache)
+    ticker_info: Dict[str, str] = field(default_factory=dict)  # ticker -> company name mapping
+
+# Global cache: 읽기는 스냅샷 참조 한 번(락 없음), 갱신은 CACHE_LOCK 하에서 원자적 교체
+CACHE = MatrixCache()
 CACHE_LOCK = threading.Lock()
 
+def _publish_matrix(matrix: np.ndarray, T: list, target_len: Optional[int] = None) -> MatrixCache:
+    """매트릭스로 새 캐시 스냅샷 구성 후 교체 (행 norm, DTW 엔벨로프는 여기서 한 번만 계산)"""
+    global CACHE
+    upper, lower = dtw_envelopes(matrix)
+    row_norms = np.linalg.norm(matrix, axis=1).astype(np.float32)
+    ticker_index = {t: i for i, t in enumerate(T)}
+    with CACHE_LOCK:
+        CACHE = replace(
+            CACHE,
+            matrix=matrix,
+            tickers=tuple(T),
+            ticker_index=ticker_index,
+            row_norms=row_norms,
+            dtw_upper=upper,
+            dtw_lower=lower,
+            target_len=target_len or CACHE.target_len,
+            # 매트릭스가 바뀌면 이전 응답 캐시 키가 모두 무효화됨
+            epoch=CACHE.epoch + 1,
+        )
+        return CACHE
+
+def _publish_ticker_info(ticker_info: Dict[str, str]) -> None:
+    """회사 이름 매핑만 교체"""
+    global CACHE
+    with CACHE_LOCK:
+        CACHE = replace(CACHE, ticker_info=ticker_info)
+
+# /similar 응답 LRU 캐시 (정규화된 스케치 해시 + epoch → 직렬화된 JSON 본문)
+RESPONSE_CACHE: "OrderedDict[bytes, bytes]" = OrderedDict()
+RESPONSE_CACHE_LOCK = threading.Lock()
+
+def _sketch_key(sketch_vec: np.ndarray, epoch: int) -> bytes:
+    """정규화된 스케치(소수 3자리 양자화)와 캐시 epoch로 응답 캐시 키 생성"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update((np.round(sketch_vec, 3) + 0.0).astype(np.float32).tobytes())  # +0.0: -0.0 → 0.0
+    h.update(epoch.to_bytes(8, "little"))
+    return h.digest()
+
+def _cached_response(key: bytes):
+    with RESPONSE_CACHE_LOCK:
+        resp = RESPONSE_CACHE.get(key)
+        if resp is not None:
+            RESPONSE_CACHE.move_to_end(key)
+        return resp
+
+def _store_response(key: bytes, resp: bytes) -> None:
+    with RESPONSE_CACHE_LOCK:
+        RESPONSE_CACHE[key] = resp
+        RESPONSE_CACHE.move_to_end(key)
+        while len(RESPONSE_CACHE) > settings.similar_cache_size:
+            RESPONSE_CACHE.popitem(last=False)
+
+def _finite(vec: np.ndarray) -> np.ndarray:
+    """NaN/inf → 0.0 (응답 직렬화용)"""
+    return np.nan_to_num(vec, nan=0.0, posinf=0.0, neginf=0.0)
+
+def _similar_body(pairs: List[Tuple[str, float]], rows: np.ndarray, sketch_vec: np.ndarray,
+                  ticker_info: Dict[str, str]) -> bytes:
+    """
+    SimilarResponse 형태의 JSON 본문을 orjson으로 직접 직렬화
+
+    float 리스트를 pydantic으로 요소별 검증하지 않고 NumPy 배열 그대로 직렬화한다.
+    (스키마/문서는 response_model=SimilarResponse 유지)
+
+    Args:
+        pairs: rank_top_k 결과 [(ticker, score), ...]
+        rows: pairs와 같은 순서의 정규화 시리즈 (k × L)
+        sketch_vec: 정규화된 스케치
+        ticker_info: ticker → 회사 이름
+    """
+    items = [
+        {
+            "ticker": t,
+            "name": ticker_info.get(t, t),  # 회사 이름
+            "score": float(s) if np.isfinite(s) else 0.0,
+            "rank": i + 1,
+            "series_norm": _finite(rows[i]),
+        }
+        for i, (t, s) in enumerate(pairs)
+    ]
+    # 스케치는 모든 항목에서 같으므로 응답 최상위에 한 번만
+    return orjson.dumps({"items": items, "sketch_norm": _finite(sketch_vec)},
+                        option=orjson.OPT_SERIALIZE_NUMPY)
+
 @app.on_event("startup")
 def warmup():
     """서버 시작 시 기존 캐시(parquet)가 있으면 메모리 캐시 생성, DB 연결 초기화"""
@@ -71,12 +168,11 @@ def warmup():
     # Load ticker info (symbol -> company name mapping)
     try:
         ticker_info = get_ticker_info()
-        with CACHE_LOCK:
-            CACHE["ticker_info"] = ticker_info
+        _publish_ticker_info(ticker_info)
         logger.info(f"Loaded ticker info for {len(ticker_info)} companies")
     except Exception as e:
         logger.warning(f"Failed to load ticker info: {e}")
-        CACHE["ticker_info"] = {}
+        _publish_ticker_info({})
 
     # Initialize PostgreSQL connection pool if data_source is postgresql
     if settings.data_source == "postgresql":
@@ -97,6 +193,14 @@ def warmup():
 
     # Load parquet cache for backward compatibility
     try:
+        # 정규화 매트릭스가 저장돼 있으면 재계산 없이 바로 사용
+        loaded = load_matrix_parquet(CACHE.target_len)
+        if loaded is not None:
+            matrix, T = loaded
+            _publish_matrix(matrix, T)
+            logger.info(f"Warmup completed: {len(T)} tickers loaded from normalized matrix")
+            return
+
         df = load_ma20_parquet()
         if df is not None and not df.empty:
             # Check if new format (with 'ticker' and 'vector' columns)
@@ -116,11 +220,8 @@ def warmup():
                         continue
 
                 if vectors:
-                    matrix = np.vstack(vectors)
-                    norm_map = {t: matrix[i, :].tolist() for i, t in enumerate(T)}
-
-                    with CACHE_LOCK:
-                        CACHE.update({"matrix": matrix, "tickers": T, "norm_map": norm_map})
+                    matrix = np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
+                    _publish_matrix(matrix, T)
 
                     logger.info(f"Warmup completed: {len(T)} tickers loaded from pre-computed vectors")
                 else:
@@ -128,11 +229,8 @@ def warmup():
             else:
                 # Old format: MA20 time series
                 ma20 = {c: df[c].dropna() for c in df.columns}
-                matrix, T = dict_to_matrix(ma20, target_len=CACHE["target_len"])
-                norm_map = {t: matrix[i, :].tolist() for i, t in enumerate(T)}
-
-                with CACHE_LOCK:
-                    CACHE.update({"matrix": matrix, "tickers": T, "norm_map": norm_map})
+                matrix, T = dict_to_matrix(ma20, target_len=CACHE.target_len)
+                _publish_matrix(matrix, T)
 
                 logger.info(f"Warmup completed: {len(T)} tickers loaded into cache")
         else:
@@ -149,7 +247,8 @@ def health():
 @app.get("/stats")
 def stats():
     """현재 캐시된 티커 개수와 데이터 소스 정보 반환"""
-    ticker_count = len(CACHE.get("tickers", [])) if CACHE.get("tickers") else 0
+    cache = CACHE
+    ticker_count = len(cache.tickers)
 
     # PostgreSQL 세그먼트 개수 (data_source가 postgresql인 경우)
     segment_count = 0
@@ -163,7 +262,7 @@ def stats():
         "ticker_count": ticker_count,
         "segment_count": segment_count,
         "data_source": settings.data_source,
-        "target_len": CACHE["target_len"]
+        "target_len": cache.target_len
     }
 
 @app.post("/ingest")
@@ -213,15 +312,13 @@ def ingest(
         })
         logger.info(f"Data saved to {p}")
 
-        # 5) 메모리 캐시 준비(행렬/티커/정규화 맵)
-        matrix, T = dict_to_matrix(ma20, target_len=CACHE["target_len"])
-        norm_map = {t: matrix[i, :].tolist() for i, t in enumerate(T)}
-
-        with CACHE_LOCK:
-            CACHE.update({"matrix": matrix, "tickers": T, "norm_map": norm_map})
+        # 5) 메모리 캐시 준비(행렬/티커/인덱스) + 정규화 매트릭스 저장 (재시작/캐시 미스 시 재사용)
+        matrix, T = dict_to_matrix(ma20, target_len=CACHE.target_len)
+        save_matrix_parquet(matrix, T)
+        cache = _publish_matrix(matrix, T)
 
         logger.info(f"Ingest completed: {len(T)} tickers cached")
-        return {"tickers_count": len(T), "ok_count": len(ok), "target_len": CACHE["target_len"]}
+        return {"tickers_count": len(T), "ok_count": len(ok), "target_len": cache.target_len}
 
     except Exception as e:
         logger.error(f"Ingest failed: {e}")
@@ -252,25 +349,31 @@ def similar(request: Request, req: SketchRequest):
     logger.info(f"Similar search started: sketch length={len(req.y)}")
 
     try:
-        # 캐시 없거나 norm_map 미구성 → 디스크에서 불러와 구성
-        if CACHE["matrix"] is None or CACHE.get("norm_map") is None:
+        # 요청 동안 같은 스냅샷 사용 (중간에 /ingest가 교체해도 일관됨)
+        cache = CACHE
+
+        # 캐시 없음 → 디스크에서 불러와 구성
+        if cache.matrix is None:
             logger.info("Cache miss, loading from disk...")
-            df = load_ma20_parquet()
-            if df is None or df.empty:
-                raise HTTPException(400, "먼저 /ingest로 데이터 캐시를 준비하세요.")
+            loaded = load_matrix_parquet(req.target_len)
+            if loaded is not None:
+                matrix, T = loaded
+            else:
+                df = load_ma20_parquet()
+                if df is None or df.empty:
+                    raise HTTPException(400, "먼저 /ingest로 데이터 캐시를 준비하세요.")
 
-            ma20 = {c: df[c].dropna() for c in df.columns}
-            matrix, T = dict_to_matrix(ma20, target_len=req.target_len)
-            norm_map = {t: matrix[i, :].tolist() for i, t in enumerate(T)}
+                ma20 = {c: df[c].dropna() for c in df.columns}
+                matrix, T = dict_to_matrix(ma20, target_len=req.target_len)
+                save_matrix_parquet(matrix, T)
 
-            with CACHE_LOCK:
-                CACHE.update({"matrix": matrix, "tickers": T, "target_len": req.target_len, "norm_map": norm_map})
+            cache = _publish_matrix(matrix, T, target_len=req.target_len)
 
             logger.info(f"Cache loaded: {len(T)} tickers")
 
         # 스케치 정규화
         y = np.array(req.y, dtype=float)
-        sketch_vec = normalize_pipeline(y, target_len=CACHE["target_len"])
+        sketch_vec = normalize_pipeline(y, target_len=cache.target_len)
         logger.debug(f"Sketch normalized to {len(sketch_vec)} points")
 
         # NaN 체크 및 제거
@@ -278,38 +381,27 @@ def similar(request: Request, req: SketchRequest):
             logger.warning("NaN detected in sketch_vec, cleaning...")
             sketch_vec = np.nan_to_num(sketch_vec, nan=0.0)
 
-        # Top5 랭킹
-        pairs = rank_top_k(sketch_vec, CACHE["matrix"], CACHE["tickers"], k=5)
-        logger.info(f"Top 5 matches found: {[t for t, _ in pairs]}")
-
-        # 응답(오버레이용 정규화 시리즈 포함)
-        items = []
-        for i, (t, s) in enumerate(pairs):
-            series_norm = CACHE["norm_map"].get(t)
-            if series_norm is None:
-                idx = CACHE["tickers"].index(t)
-                series_norm = CACHE["matrix"][idx, :].tolist()
+        # 매트릭스와 같은 float32로 맞춰 SGEMV 사용
+        sketch_vec = sketch_vec.astype(np.float32)
 
-            # NaN 제거 (리스트인 경우)
-            if isinstance(series_norm, list):
-                series_norm = [0.0 if (isinstance(x, float) and not np.isfinite(x)) else x for x in series_norm]
+        # 같은 스케치 재요청은 랭킹 없이 캐시된 응답 반환
+        key = _sketch_key(sketch_vec, cache.epoch)
+        cached = _cached_response(key)
+        if cached is not None:
+            logger.info("Similar search served from response cache")
+            return Response(content=cached, media_type="application/json")
 
-            # sketch_norm도 NaN 제거
-            sketch_norm_list = [0.0 if not np.isfinite(x) else float(x) for x in sketch_vec]
-
-            # 회사 이름 가져오기
-            company_name = CACHE.get("ticker_info", {}).get(t, t)
-
-            items.append(SimilarResponseItem(
-                ticker=t,
-                name=company_name,
-                score=float(s) if np.isfinite(s) else 0.0,
-                rank=i+1,
-                series_norm=series_norm,       # 해당 종목 MA20 (정규화)
-                sketch_norm=sketch_norm_list   # 스케치 (정규화)
-            ))
+        # Top5 랭킹
+        pairs = rank_top_k(sketch_vec, cache.matrix, cache.tickers, k=5,
+                           row_norms=cache.row_norms,
+                           upper=cache.dtw_upper, lower=cache.dtw_lower)
+        logger.info(f"Top 5 matches found: {[t for t, _ in pairs]}")
 
-        return SimilarResponse(items=items)
+        # 응답(오버레이용 정규화 시리즈 포함) - 반환되는 k개 행만 사용
+        rows = cache.matrix[[cache.ticker_index[t] for t, _ in pairs]]
+        body = _similar_body(pairs, rows, sketch_vec, cache.ticker_info)
+        _store_response(key, body)
+        return Response(content=body, media_type="application/json")
 
     except HTTPException:
         raise
@@ -354,33 +446,10 @@ def similar_db(request: Request, req: SketchRequest):
         pairs = rank_top_k(sketch_vec, vectors, tickers, k=5)
         logger.info(f"Top 5 matches found: {[t for t, _ in pairs]}")
 
-        # 응답 구성 (메타데이터 포함)
-        items = []
-        for i, (t, s) in enumerate(pairs):
-            # 해당 티커의 첫 번째 매칭 찾기 (같은 티커의 여러 세그먼트 중)
-            ticker_idx = tickers.index(t)
-            series_norm = vectors[ticker_idx, :].tolist()
-            meta = metadata[ticker_idx]
-
-            # NaN 제거
-            if isinstance(series_norm, list):
-                series_norm = [0.0 if (isinstance(x, float) and not np.isfinite(x)) else x for x in series_norm]
-
-            sketch_norm_list = [0.0 if not np.isfinite(x) else float(x) for x in sketch_vec]
-
-            # 회사 이름 가져오기
-            company_name = CACHE.get("ticker_info", {}).get(t, t)
-
-            items.append(SimilarResponseItem(
-                ticker=t,
-                name=company_name,
-                score=float(s) if np.isfinite(s) else 0.0,
-                rank=i+1,
-                series_norm=series_norm,       # DB 세그먼트 (128차원)
-                sketch_norm=sketch_norm_list   # 스케치 (128차원)
-            ))
-
-        return SimilarResponse(items=items)
+        # 응답 구성 - 같은 티커의 여러 세그먼트 중 첫 번째 매칭 사용
+        rows = vectors[[tickers.index(t) for t, _ in pairs]]
+        body = _similar_body(pairs, rows, sketch_vec, CACHE.ticker_info)
+        return Response(content=body, media_type="application/json")
 
     except HTTPException:
         raise
@@ -14,7 +14,7 @@ class SimilarResponseItem(BaseModel):
     score: float
     rank: int
     series_norm: List[float]
-    sketch_norm: List[float]
 
 class SimilarResponse(BaseModel):
-    items: List[SimilarResponseItem]
\ No newline at end of file
+    items: List[SimilarResponseItem]
+    sketch_norm: List[float]  # 정규화된 스케치 (모든 항목 공통, 한 번만 전송)
\ No newline at end of file
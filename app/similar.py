@@ -1,30 +1,119 @@
 import numpy as np
 import logging
-from fastdtw import fastdtw
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
 from scipy.stats import pearsonr
 from numpy.linalg import norm
 from typing import Tuple, List
 
 logger = logging.getLogger(__name__)
 
-def dtw_distance(a: np.ndarray, b: np.ndarray) -> float:
+# numba가 있으면 DTW 커널을 JIT 컴파일, 없으면 동일 코드를 Python으로 실행
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# 1단계(Pearson/Cosine) 프리필터 후 DTW를 계산할 후보 수
+PREFILTER_M = 50
+# Sakoe-Chiba 밴드 반경 (|i - j| <= DTW_RADIUS 인 셀만 계산)
+DTW_RADIUS = 20
+
+def _dtw_banded(a: np.ndarray, b: np.ndarray, r: int) -> float:
+    """
+    Sakoe-Chiba 밴드 DTW (O(n·r), 절대값 거리)
     """
-    Dynamic Time Warping 거리 계산
+    n = a.shape[0]
+    m = b.shape[0]
+    # 길이가 달라도 끝점(n, m)에 도달할 수 있도록 밴드 확장
+    r = max(r, abs(n - m))
+    cost = np.full((n + 1, m + 1), np.inf)
+    cost[0, 0] = 0.0
+    for i in range(1, n + 1):
+        for j in range(max(1, i - r), min(m, i + r) + 1):
+            best = cost[i - 1, j]
+            if cost[i, j - 1] < best:
+                best = cost[i, j - 1]
+            if cost[i - 1, j - 1] < best:
+                best = cost[i - 1, j - 1]
+            cost[i, j] = abs(a[i - 1] - b[j - 1]) + best
+    return cost[n, m]
+
+if NUMBA_AVAILABLE:
+    # nogil: 동시 /similar 요청의 DTW가 GIL 없이 여러 코어에서 실행됨
+    _dtw_banded = njit(cache=True, fastmath=True, nogil=True)(_dtw_banded)
+
+    # parallel=True를 쓰지 않음: 후보는 프리필터 후 수십 개라 요청 하나는 단일 스레드로 충분하고,
+    # nogil로 동시 요청끼리 코어를 나눠 씀 (workqueue 스레딩 레이어는 동시 호출 시 프로세스 중단)
+    @njit(fastmath=True, cache=True, nogil=True)
+    def _dtw_batch(sketch, cands, r):
+        """후보 행별 DTW 거리"""
+        out = np.empty(cands.shape[0])
+        for i in range(cands.shape[0]):
+            out[i] = _dtw_banded(sketch, cands[i], r)
+        return out
+else:
+    def _dtw_batch(sketch, cands, r):
+        """후보 행별 DTW 거리"""
+        return np.array([_dtw_banded(sketch, row, r) for row in cands], dtype=np.float64)
+
+def dtw_distance(a: np.ndarray, b: np.ndarray, radius: int = DTW_RADIUS) -> float:
+    """
+    Dynamic Time Warping 거리 계산 (밴드 DTW)
 
     Args:
         a, b: 비교할 시계열
+        radius: Sakoe-Chiba 밴드 반경
 
     Returns:
         DTW 거리 (항상 유효한 float)
     """
     try:
-        d, _ = fastdtw(a, b)
-        result = float(d)
+        result = float(_dtw_banded(np.asarray(a, dtype=np.float64),
+                                   np.asarray(b, dtype=np.float64), radius))
         return result if np.isfinite(result) else 0.0
     except Exception as e:
         logger.warning(f"DTW calculation failed: {e}")
         return 0.0
 
+# 첫 /similar 요청이 JIT 컴파일 시간을 부담하지 않도록 import 시 워밍업
+_warm = np.zeros(200)
+dtw_distance(_warm, _warm)
+_dtw_batch(_warm, _warm[None, :], DTW_RADIUS)
+del _warm
+
+def dtw_envelopes(matrix: np.ndarray, r: int = DTW_RADIUS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    LB_Keogh용 행별 상/하한 엔벨로프 (각 위치 기준 ±r 구간의 max/min)
+
+    Args:
+        matrix: (N × L) 시계열 매트릭스
+        r: Sakoe-Chiba 밴드 반경 (dtw_distance와 동일해야 함)
+
+    Returns:
+        (upper, lower) - 각각 (N × L)
+    """
+    size = 2 * r + 1
+    upper = maximum_filter1d(matrix, size=size, axis=1, mode="nearest")
+    lower = minimum_filter1d(matrix, size=size, axis=1, mode="nearest")
+    return upper, lower
+
+def lb_keogh(sketch: np.ndarray, upper: np.ndarray, lower: np.ndarray) -> np.ndarray:
+    """
+    LB_Keogh 하한 (행별, 밴드 DTW 거리 이하가 보장됨)
+
+    밴드 DTW에서 sketch[i]는 row[i-r..i+r] 중 하나 이상과 매칭되므로
+    엔벨로프 밖으로 벗어난 거리의 합은 DTW 거리를 넘지 않는다.
+
+    Args:
+        sketch: 스케치 벡터 (L,)
+        upper, lower: dtw_envelopes 결과 (M × L)
+
+    Returns:
+        (M,) 하한 배열
+    """
+    return (np.maximum(sketch - upper, 0.0) + np.maximum(lower - sketch, 0.0)).sum(axis=1)
+
 def cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
     """
     코사인 유사도 계산 (NaN 안전)
@@ -135,48 +224,145 @@ def ensemble_score(sketch: np.ndarray, series: np.ndarray,
         logger.error(f"Ensemble score calculation failed: {e}")
         return 0.0
 
+def pearson_cosine_all(sketch: np.ndarray, db_matrix: np.ndarray,
+                       row_norms: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    스케치 대비 모든 행의 Pearson / Cosine을 한 번에 계산 (행마다 Python 호출 대신 GEMM 1회)
+
+    Args:
+        sketch: 스케치 벡터 (L,)
+        db_matrix: 티커 매트릭스 (N × L)
+        row_norms: 행별 L2 norm (없으면 계산)
+
+    Returns:
+        (pearson_all, cosine_all) - 각각 (N,), 계산 불가(0 분산/0 벡터/NaN) 항목은 0.0
+    """
+    n_rows, L = db_matrix.shape
+    if np.any(np.isnan(sketch)):
+        logger.warning("NaN detected in sketch, pearson/cosine set to 0")
+        return np.zeros(n_rows), np.zeros(n_rows)
+
+    if row_norms is None:
+        row_norms = norm(db_matrix, axis=1)
+
+    # 스케치 쪽 불변값은 한 번만 계산
+    sk_c = sketch - sketch.mean()
+    sk_norm = norm(sketch)
+    skc_norm = norm(sk_c)
+
+    # 중심화된 스케치는 합이 0 → (row - row_mean) · sk_c == row · sk_c
+    # 두 벡터를 한 번에 곱해 매트릭스를 한 번만 읽음 (GEMV 2회 → GEMM 1회)
+    dots, dots_c = (db_matrix @ np.column_stack((sketch, sk_c)).astype(db_matrix.dtype)).T
+
+    row_means = db_matrix.mean(axis=1)
+    row_c_norms = np.sqrt(np.maximum(row_norms ** 2 - L * row_means ** 2, 0.0))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pearson_all = dots_c / (row_c_norms * skc_norm)
+        cosine_all = dots / (row_norms * sk_norm)
+
+    # 0 분산 / 0 벡터 → 0.0 (scalar pearson / cosine_sim과 동일한 규칙)
+    pearson_all[row_c_norms < 1e-10 * np.sqrt(L)] = 0.0
+    cosine_all[row_norms < 1e-10] = 0.0
+    if skc_norm < 1e-10 * np.sqrt(L):
+        pearson_all[:] = 0.0
+    if sk_norm < 1e-10:
+        cosine_all[:] = 0.0
+
+    pearson_all = np.clip(np.nan_to_num(pearson_all, nan=0.0, posinf=0.0, neginf=0.0), -1.0, 1.0)
+    cosine_all = np.clip(np.nan_to_num(cosine_all, nan=0.0, posinf=0.0, neginf=0.0), -1.0, 1.0)
+    return pearson_all, cosine_all
+
 def rank_top_k(sketch_vec: np.ndarray, db_matrix: np.ndarray,
-               tickers: List[str], k: int = 5) -> List[Tuple[str, float]]:
+               tickers: List[str], k: int = 5,
+               alpha: float = 0.7, beta: float = 0.2, gamma: float = 0.1,
+               prefilter_m: int = PREFILTER_M,
+               row_norms: np.ndarray = None,
+               upper: np.ndarray = None,
+               lower: np.ndarray = None) -> List[Tuple[str, float]]:
     """
     Top-K 유사 종목 랭킹 (NaN 안전)
 
+    2단계 검색:
+      1) 전체 행에 대해 Pearson/Cosine을 벡터화 계산 → 상위 prefilter_m개 후보 선택
+      2) 후보에 대해서만 DTW 계산 → 앙상블 스코어로 재정렬
+         (LB_Keogh 스코어 상한이 현재 k번째 스코어보다 낮은 후보는 DTW 생략)
+
     Args:
         sketch_vec: 스케치 벡터
         db_matrix: 티커 매트릭스 (N × target_len)
         tickers: 티커 심볼 리스트
         k: 반환할 상위 개수
+        alpha, beta, gamma: DTW / Pearson / Cosine 가중치 (ensemble_score와 동일)
+        prefilter_m: DTW를 계산할 후보 수
+        row_norms: db_matrix의 행별 L2 norm (캐시 구성 시 미리 계산, 없으면 계산)
+        upper, lower: db_matrix의 DTW 엔벨로프 (dtw_envelopes, 없으면 후보에 대해 계산)
 
     Returns:
         [(ticker, score), ...] 리스트 (스코어 내림차순)
     """
     logger.info(f"Ranking top {k} from {len(tickers)} tickers")
 
-    # 모든 스코어 계산
-    scores = []
-    valid_count = 0
-
-    for i, row in enumerate(db_matrix):
-        score = ensemble_score(sketch_vec, row)
-        scores.append(score)
-
-        if np.isfinite(score):
-            valid_count += 1
-
-    logger.info(f"Valid scores: {valid_count}/{len(scores)}")
-
-    # NaN을 -inf로 대체하여 정렬 시 뒤로 밀림
-    scores_array = np.array(scores)
-    scores_array = np.nan_to_num(scores_array, nan=-np.inf, posinf=-np.inf, neginf=-np.inf)
-
-    # Top-K 추출
-    idx = np.argsort(scores_array)[::-1][:k]
+    # Pearson / Cosine: 전체 행 한 번에 (-1~1 → 0~1)
+    pearson_all, cosine_all = pearson_cosine_all(sketch_vec, db_matrix, row_norms)
+    c_normalized = (pearson_all + 1.0) / 2.0
+    s_normalized = (cosine_all + 1.0) / 2.0
+
+    # 1단계: 저비용 프리필터 (O(N) argpartition)
+    prelim = beta * c_normalized + gamma * s_normalized
+    n_rows = len(prelim)
+    if n_rows > prefilter_m:
+        cand_idx = np.argpartition(-prelim, prefilter_m)[:prefilter_m]
+    else:
+        cand_idx = np.arange(n_rows)
+
+    # 2단계: 후보에 대해서만 DTW 거리 → 유사도 (0~1)
+    L = len(sketch_vec)
+    sk64 = np.ascontiguousarray(sketch_vec, dtype=np.float64)
+    cands = np.ascontiguousarray(db_matrix[cand_idx], dtype=np.float64)
+    cand_prelim = prelim[cand_idx]
+
+    def _ensemble(rows: np.ndarray) -> np.ndarray:
+        dtw_all = _dtw_batch(sk64, cands[rows], DTW_RADIUS)
+        dtw_all[~np.isfinite(dtw_all)] = 0.0  # dtw_distance와 동일한 규칙
+        return alpha / (1.0 + dtw_all / L) + cand_prelim[rows]
+
+    # LB_Keogh ≤ DTW 이므로 스코어 상한을 DTW 없이 계산 가능
+    if upper is not None and lower is not None:
+        cand_upper, cand_lower = upper[cand_idx], lower[cand_idx]
+    else:
+        cand_upper, cand_lower = dtw_envelopes(cands)
+    score_ub = alpha / (1.0 + lb_keogh(sk64, cand_upper, cand_lower) / L) + cand_prelim
+
+    # 상한이 높은 k개를 먼저 평가 → 상한이 k번째 스코어에 못 미치는 후보는 DTW 생략
+    by_ub = np.argsort(-score_ub)
+    first, rest = by_ub[:k], by_ub[k:]
+    scores_array = np.full(len(cand_idx), -np.inf)
+    scores_array[first] = _ensemble(first)
+    threshold = scores_array[first].min() if len(first) else -np.inf
+    if np.isfinite(threshold):
+        rest = rest[score_ub[rest] >= threshold - 1e-9]
+    scores_array[rest] = _ensemble(rest)
+    evaluated = len(first) + len(rest)
+    logger.info(f"DTW evaluated: {evaluated}/{len(cand_idx)} candidates (LB_Keogh pruned {len(cand_idx) - evaluated})")
+
+    valid_count = int(np.isfinite(scores_array).sum())
+    logger.info(f"Valid scores: {valid_count}/{len(scores_array)}")
+
+    # 0~1 범위 보장 (생략된 후보는 -inf 유지), NaN을 -inf로 대체하여 정렬 시 뒤로 밀림
+    scores_array = np.where(np.isfinite(scores_array), np.clip(scores_array, 0.0, 1.0), -np.inf)
+
+    # Top-K 추출: argpartition으로 k개 선택 후 k개만 정렬
+    k = min(k, len(scores_array))
+    order = np.argpartition(-scores_array, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.int64)
+    order = order[np.argsort(-scores_array[order])]
 
     results = []
-    for i in idx:
-        score = float(scores_array[i])
+    for j in order:
+        score = float(scores_array[j])
         # -inf는 제외
         if score > -np.inf:
-            results.append((tickers[i], score))
+            results.append((tickers[cand_idx[j]], score))
 
     logger.info(f"Top {len(results)} results: {[t for t, _ in results]}")
     return results
@@ -1,43 +1,58 @@
 # app/tickers.py
-import requests, time, json, re
+import requests, time, re, os, mmap
+from itertools import islice
+import orjson
+import ijson  # 가장 빠른 백엔드(yajl2_c) 자동 선택
 import logging
 from pathlib import Path
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
+
+from .config import settings
 
 logger = logging.getLogger(__name__)
 
 DATA_DIR = Path("data")
 DATA_DIR.mkdir(exist_ok=True)
-CACHE_FILE = DATA_DIR / "tickers_nasdaq.json"
+CACHE_FILE = DATA_DIR / "tickers_nasdaq.json"  # DB/ingest_prices.py 호환용
+CACHE_TXT_FILE = DATA_DIR / "tickers_nasdaq.txt"  # 정렬된 줄 단위 캐시 (앞에서부터 필요한 만큼만 읽음)
 TICKER_INFO_CACHE = DATA_DIR / "ticker_info.json"
 
-# Use config if available, otherwise fallback
-try:
-    from .config import settings
-    CACHE_TTL_SEC = settings.cache_ttl_sec
-except ImportError:
-    CACHE_TTL_SEC = 24 * 3600  # 캐시 유효기간 1일
+CACHE_TTL_SEC = settings.cache_ttl_sec  # 캐시 유효기간 (환경 변수 CACHE_TTL_SEC로 변경 가능, 기본 1일)
 
 HEADERS = {"User-Agent": "Mozilla/5.0"}
 NASDAQ_API = "https://api.nasdaq.com/api/screener/stocks?tableonly=true&limit=9999"
 
-_symbol_ok = re.compile(r"^[A-Z][A-Z0-9\.\-]*$")
-
-def _normalize_for_yfinance(symbol: str) -> str:
-    s = symbol.strip().upper().replace(".", "-")
-    return s
+# 갱신 간 TCP/TLS 연결 재사용 + 압축 응답 요청
+_SESSION = requests.Session()
+_SESSION.headers.update({**HEADERS, "Accept-Encoding": "gzip, deflate"})
+
+# 대문자로 시작하는 심볼 ("^", "$" 등으로 시작하는 지수/특수 심볼은 자동 제외)
+_EQUITY_RE = re.compile(r"^[A-Z][A-Z0-9.\-]*$")
+# SPAC/워런트 등 제외 ("."은 yfinance 정규화 시 "-"가 되므로 둘 다 매칭, str.endswith 한 번으로 검사)
+_BAD_SUFFIXES = (".WT", ".WS", ".W", ".R", ".U", "-WT", "-WS", "-W", "-R", "-U")
+
+# 프로세스 내 티커 캐시 (파일 mtime, 티커 리스트, 전체 여부) - 파일이 그대로면 재파싱 생략
+_MEM_CACHE: Optional[Tuple[float, List[str], bool]] = None
+
+def _atomic_write_bytes(path: Path, data: bytes) -> None:
+    """같은 디렉터리의 임시 파일에 쓴 뒤 os.replace로 교체 (중간 종료 시에도 부분 파일이 남지 않음)"""
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _load_json_mmap(path: Path):
+    """파일을 mmap으로 매핑해 복사 없이 JSON 파싱"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"Empty cache file: {path}")  # 빈 파일은 mmap 불가
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as buf:
+            return orjson.loads(buf)
 
 def _looks_like_equity(symbol: str) -> bool:
-    if not _symbol_ok.match(symbol):
-        return False
-    bad_prefix = ("^", "$")
-    if symbol.startswith(bad_prefix):
-        return False
-    s = _normalize_for_yfinance(symbol)
-    bad_fragments = ("-WT", "-WS", "-W", "-R", "-U")  # SPAC/워런트 등 제외
-    if any(s.endswith(f) for f in bad_fragments):
-        return False
-    return True
+    return bool(_EQUITY_RE.match(symbol)) and not symbol.endswith(_BAD_SUFFIXES)
 
 def fetch_ticker_info_from_nasdaq() -> Dict[str, str]:
     """
@@ -51,39 +66,39 @@ def fetch_ticker_info_from_nasdaq() -> Dict[str, str]:
         ValueError: 응답 파싱 실패 시
     """
     try:
-        logger.info(f"Fetching ticker info from NASDAQ API: {NASDAQ_API}")
-        r = requests.get(NASDAQ_API, headers=HEADERS, timeout=30)
-        r.raise_for_status()
-
-        data = r.json()
-        if "data" not in data or "table" not in data["data"] or "rows" not in data["data"]["table"]:
-            raise ValueError("Invalid response format from NASDAQ API")
-
-        rows = data["data"]["table"]["rows"]
+        logger.info("Fetching ticker info from NASDAQ API: %s", NASDAQ_API)
         ticker_info = {}
+        row_count = 0
+
+        # 응답 전체를 dict로 만들지 않고 rows 항목을 수신하면서 하나씩 파싱
+        with _SESSION.get(NASDAQ_API, timeout=30, stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True  # gzip 등 Content-Encoding 해제
+            for row in ijson.items(r.raw, "data.table.rows.item"):
+                row_count += 1
+                symbol = row.get("symbol")
+                name = row.get("name", symbol)  # Fallback to symbol if no name
 
-        for row in rows:
-            symbol = row.get("symbol")
-            name = row.get("name", symbol)  # Fallback to symbol if no name
+                if not symbol or not _looks_like_equity(symbol):
+                    continue
 
-            if not symbol or not _looks_like_equity(symbol):
-                continue
+                # Normalize symbol for yfinance (매칭된 심볼은 이미 대문자/공백 없음)
+                ticker_info[symbol.replace(".", "-")] = name
 
-            # Normalize symbol for yfinance
-            normalized = _normalize_for_yfinance(symbol)
-            ticker_info[normalized] = name
+        if row_count == 0:
+            raise ValueError("Invalid response format from NASDAQ API")
 
-        logger.info(f"Fetched info for {len(ticker_info)} tickers")
+        logger.info("Fetched info for %d tickers", len(ticker_info))
         return ticker_info
 
     except requests.RequestException as e:
-        logger.error(f"Network error while fetching tickers: {e}")
+        logger.error("Network error while fetching tickers: %s", e)
         raise
-    except (KeyError, ValueError) as e:
-        logger.error(f"Failed to parse NASDAQ API response: {e}")
+    except (KeyError, ValueError, ijson.JSONError) as e:
+        logger.error("Failed to parse NASDAQ API response: %s", e)
         raise ValueError(f"NASDAQ API 응답 파싱 실패: {e}")
     except Exception as e:
-        logger.error(f"Unexpected error in fetch_ticker_info_from_nasdaq: {e}")
+        logger.error("Unexpected error in fetch_ticker_info_from_nasdaq: %s", e)
         raise
 
 def fetch_tickers_from_nasdaq() -> List[str]:
@@ -94,54 +109,78 @@ def fetch_tickers_from_nasdaq() -> List[str]:
         정규화된 티커 심볼 리스트
     """
     ticker_info = fetch_ticker_info_from_nasdaq()
-    return sorted(ticker_info.keys())
-
-def load_cached_tickers() -> Optional[List[str]]:
-    """캐시 파일에서 티커 로드 (TTL 확인)"""
-    if CACHE_FILE.exists():
-        mtime = CACHE_FILE.stat().st_mtime
-        age = time.time() - mtime
-        if age < CACHE_TTL_SEC:
-            try:
-                tickers = json.loads(CACHE_FILE.read_text())
-                logger.info(f"Loaded {len(tickers)} tickers from cache (age: {age/3600:.1f}h)")
-                return tickers
-            except Exception as e:
-                logger.warning(f"Failed to load cache file: {e}")
-                return None
-        else:
-            logger.info(f"Cache expired (age: {age/3600:.1f}h > {CACHE_TTL_SEC/3600:.1f}h)")
-    return None
+    return sorted(ticker_info)  # dict 키는 이미 필터·정규화·중복 제거됨
+
+def _read_ticker_cache(max_count: Optional[int]) -> Tuple[List[str], bool]:
+    """줄 단위 캐시에서 앞의 max_count개만 읽기 (없으면 JSON 캐시 전체). (티커 리스트, 전체 여부) 반환"""
+    try:
+        f = open(CACHE_TXT_FILE, "rb")
+    except FileNotFoundError:
+        return _load_json_mmap(CACHE_FILE), True
+    with f:
+        lines = f if max_count is None else islice(f, max_count)
+        tickers = [line.rstrip(b"\n").decode() for line in lines]
+    return tickers, max_count is None or len(tickers) < max_count
+
+def load_cached_tickers(max_count: Optional[int] = None) -> Optional[List[str]]:
+    """캐시 파일에서 상위 max_count개 티커 로드 (TTL 확인, 파일 mtime이 같으면 메모리 캐시 사용)"""
+    global _MEM_CACHE
+    try:
+        mtime = CACHE_FILE.stat().st_mtime  # stat 한 번으로 존재 여부 + mtime 확인
+    except FileNotFoundError:
+        return None
+    age = time.time() - mtime
+    if age >= CACHE_TTL_SEC:
+        logger.info("Cache expired (age: %.1fh > %.1fh)", age / 3600, CACHE_TTL_SEC / 3600)
+        return None
+
+    mem = _MEM_CACHE
+    if mem is not None and mem[0] == mtime and (mem[2] or (max_count is not None and len(mem[1]) >= max_count)):
+        logger.debug("Using in-memory tickers (%d)", len(mem[1]))
+        return mem[1][:max_count]
+    try:
+        tickers, complete = _read_ticker_cache(max_count)
+        _MEM_CACHE = (mtime, tickers, complete)
+        logger.info("Loaded %d tickers from cache (age: %.1fh)", len(tickers), age / 3600)
+        return tickers[:max_count]
+    except Exception as e:
+        logger.warning("Failed to load cache file: %s", e)
+        return None
 
 def save_cached_tickers(symbols: List[str]) -> None:
     """티커 리스트를 캐시 파일에 저장"""
+    global _MEM_CACHE
     try:
-        CACHE_FILE.write_text(json.dumps(symbols, indent=2))
-        logger.info(f"Saved {len(symbols)} tickers to cache: {CACHE_FILE}")
+        # 줄 단위 캐시를 먼저 쓰고 JSON(mtime 기준 파일)을 마지막에 교체
+        _atomic_write_bytes(CACHE_TXT_FILE, "\n".join(symbols).encode())
+        _atomic_write_bytes(CACHE_FILE, orjson.dumps(symbols, option=orjson.OPT_INDENT_2))
+        _MEM_CACHE = None  # 교체된 파일 기준으로 다시 읽도록 무효화
+        logger.info("Saved %d tickers to cache: %s", len(symbols), CACHE_FILE)
     except Exception as e:
-        logger.error(f"Failed to save cache file: {e}")
+        logger.error("Failed to save cache file: %s", e)
 
 def load_ticker_info() -> Optional[Dict[str, str]]:
     """캐시에서 티커 정보 (심볼 -> 회사명) 로드"""
-    if TICKER_INFO_CACHE.exists():
+    try:
         mtime = TICKER_INFO_CACHE.stat().st_mtime
-        age = time.time() - mtime
-        if age < CACHE_TTL_SEC:
-            try:
-                info = json.loads(TICKER_INFO_CACHE.read_text())
-                logger.info(f"Loaded ticker info for {len(info)} tickers from cache")
-                return info
-            except Exception as e:
-                logger.warning(f"Failed to load ticker info cache: {e}")
+    except FileNotFoundError:
+        return None
+    if time.time() - mtime < CACHE_TTL_SEC:
+        try:
+            info = _load_json_mmap(TICKER_INFO_CACHE)
+            logger.info("Loaded ticker info for %d tickers from cache", len(info))
+            return info
+        except Exception as e:
+            logger.warning("Failed to load ticker info cache: %s", e)
     return None
 
 def save_ticker_info(ticker_info: Dict[str, str]) -> None:
     """티커 정보를 캐시 파일에 저장"""
     try:
-        TICKER_INFO_CACHE.write_text(json.dumps(ticker_info, indent=2, ensure_ascii=False))
-        logger.info(f"Saved ticker info for {len(ticker_info)} tickers to cache")
+        _atomic_write_bytes(TICKER_INFO_CACHE, orjson.dumps(ticker_info, option=orjson.OPT_INDENT_2))  # UTF-8 그대로
+        logger.info("Saved ticker info for %d tickers to cache", len(ticker_info))
     except Exception as e:
-        logger.error(f"Failed to save ticker info cache: {e}")
+        logger.error("Failed to save ticker info cache: %s", e)
 
 def get_ticker_info(force_refresh: bool = False) -> Dict[str, str]:
     """
@@ -158,7 +197,7 @@ def get_ticker_info(force_refresh: bool = False) -> Dict[str, str]:
         if cached:
             return cached
 
-    logger.info(f"Fetching fresh ticker info from NASDAQ (force_refresh={force_refresh})")
+    logger.info("Fetching fresh ticker info from NASDAQ (force_refresh=%s)", force_refresh)
     info = fetch_ticker_info_from_nasdaq()
     save_ticker_info(info)
     return info
@@ -175,12 +214,12 @@ def get_tickers(max_count: int = 5000, force_refresh: bool = False) -> List[str]
         티커 심볼 리스트
     """
     if not force_refresh:
-        cached = load_cached_tickers()
+        cached = load_cached_tickers(max_count)
         if cached:
-            logger.info(f"Using cached tickers (requested: {max_count}, available: {len(cached)})")
-            return cached[:max_count]
+            logger.info("Using cached tickers (requested: %s, loaded: %d)", max_count, len(cached))
+            return cached
 
-    logger.info(f"Fetching fresh tickers from NASDAQ (force_refresh={force_refresh})")
+    logger.info("Fetching fresh tickers from NASDAQ (force_refresh=%s)", force_refresh)
     syms = fetch_tickers_from_nasdaq()
     save_cached_tickers(syms)
     return syms[:max_count]
@@ -26,6 +26,8 @@ print()
 try:
     # 연결
     conn = psycopg2.connect(**conn_params)
+    # 조회 전용 스크립트이므로 트랜잭션 없이 실행
+    conn.autocommit = True
     cur = conn.cursor()
 
     print("✅ 연결 성공!")
@@ -37,25 +39,22 @@ try:
         FROM information_schema.tables
         WHERE table_schema = 'public'
     """)
-    tables = cur.fetchall()
-    print(f"📊 테이블 목록: {[t[0] for t in tables]}")
+    tables = {t[0] for t in cur}
+    print(f"📊 테이블 목록: {sorted(tables)}")
     print()
 
     # graph_segments 테이블 확인
-    if ('graph_segments',) in tables:
-        # 총 레코드 수
-        cur.execute("SELECT COUNT(*) FROM graph_segments")
-        total = cur.fetchone()[0]
-        print(f"📈 graph_segments 테이블:")
-        print(f"  - 총 세그먼트 수: {total:,}")
-
-        # MA 타입별 개수
+    if 'graph_segments' in tables:
+        # MA 타입별 개수 (총 개수는 합계로 계산해 쿼리 1회 절약)
         cur.execute("""
             SELECT ma_type, COUNT(*)
             FROM graph_segments
             GROUP BY ma_type
         """)
         ma_counts = cur.fetchall()
+        total = sum(count for _, count in ma_counts)
+        print(f"📈 graph_segments 테이블:")
+        print(f"  - 총 세그먼트 수: {total:,}")
         print(f"  - MA 타입별 개수:")
         for ma_type, count in ma_counts:
             print(f"    • {ma_type}: {count:,}")
@@ -73,9 +72,8 @@ try:
             WHERE ma_type = 'MA20'
             LIMIT 3
         """)
-        samples = cur.fetchall()
         print(f"\n  📝 샘플 데이터 (최근 3개):")
-        for ticker, start, end, dim in samples:
+        for ticker, start, end, dim in cur:
             print(f"    • {ticker}: {start} ~ {end} (벡터 차원: {dim})")
     else:
         print("⚠️  graph_segments 테이블이 없습니다!")
@@ -3,53 +3,66 @@
 import requests
 import json
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 # API 엔드포인트
 BASE_URL = "http://localhost:8080"
 
+# 요청 간 연결 재사용 (패턴별 요청은 스레드로 동시에 전송)
+_SESSION = requests.Session()
+
+# 재현 가능한 테스트 패턴 생성을 위한 고정 시드 난수 생성기 (PCG64)
+_RNG = np.random.default_rng(42)
+
 # 테스트용 스케치 데이터 생성
 # 상승 추세 패턴
 def generate_uptrend():
     """상승 추세 패턴 생성"""
     x = np.linspace(0, 10, 100)
-    y = x + np.random.normal(0, 0.5, 100)
+    y = x + _RNG.standard_normal(100) * 0.5
     return y.tolist()
 
 # 하락 추세 패턴
 def generate_downtrend():
     """하락 추세 패턴 생성"""
     x = np.linspace(0, 10, 100)
-    y = -x + np.random.normal(0, 0.5, 100)
+    y = -x + _RNG.standard_normal(100) * 0.5
     return y.tolist()
 
 # V자 반등 패턴
 def generate_v_shape():
     """V자 반등 패턴 생성"""
     x = np.linspace(0, 10, 100)
-    y = np.abs(x - 5) * -1 + np.random.normal(0, 0.3, 100)
+    y = np.abs(x - 5) * -1 + _RNG.standard_normal(100) * 0.3
     return y.tolist()
 
 # 사인파 패턴
 def generate_sine():
     """사인파 패턴 생성"""
     x = np.linspace(0, 4 * np.pi, 100)
-    y = np.sin(x) + np.random.normal(0, 0.1, 100)
+    y = np.sin(x) + _RNG.standard_normal(100) * 0.1
     return y.tolist()
 
-def test_similar_db(sketch_data, pattern_name):
-    """DB 기반 유사도 검색 테스트"""
-    print(f"\n{'='*60}")
-    print(f"🔍 테스트: {pattern_name}")
-    print(f"{'='*60}")
-
-    # API 요청
+def request_similar_db(sketch_data):
+    """/similar_db 요청 전송 (출력 없이 응답 또는 예외 반환)"""
     payload = {
         "y": sketch_data,
         "target_len": 128
     }
+    try:
+        return _SESSION.post(f"{BASE_URL}/similar_db", json=payload, timeout=30)
+    except Exception as e:
+        return e
+
+def test_similar_db(response, pattern_name):
+    """DB 기반 유사도 검색 테스트 결과 출력"""
+    print(f"\n{'='*60}")
+    print(f"🔍 테스트: {pattern_name}")
+    print(f"{'='*60}")
 
     try:
-        response = requests.post(f"{BASE_URL}/similar_db", json=payload, timeout=30)
+        if isinstance(response, Exception):
+            raise response
         response.raise_for_status()
 
         result = response.json()
@@ -80,7 +93,7 @@ def main():
 
     # 서버 헬스 체크
     try:
-        response = requests.get(f"{BASE_URL}/health", timeout=5)
+        response = _SESSION.get(f"{BASE_URL}/health", timeout=5)
         if response.json().get('ok'):
             print("✅ 서버 정상 작동 중\n")
         else:
@@ -100,8 +113,12 @@ def main():
         (generate_sine(), "🌊 사인파 패턴")
     ]
 
-    for sketch, name in patterns:
-        test_similar_db(sketch, name)
+    # 요청은 동시에 보내고 결과는 패턴 순서대로 출력
+    with ThreadPoolExecutor(max_workers=len(patterns)) as pool:
+        responses = list(pool.map(request_similar_db, [sketch for sketch, _ in patterns]))
+
+    for response, (_, name) in zip(responses, patterns):
+        test_similar_db(response, name)
 
     print("\n" + "=" * 60)
     print("✅ 모든 테스트 완료!")
@@ -0,0 +1,78 @@
+"""
+compute_ma20 회귀 테스트
+
+멀티 티커 다운로드는 날짜 인덱스가 티커들의 합집합이라, 한 티커만 빠진 날(내부 결측)이 생길 수 있음.
+결측이 있어도 해당 티커의 관측치 기준 MA20을 유지하는지 고정
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from app.data_io import compute_ma20, MA_WINDOW
+
+
+def _ohlc(closes: dict) -> pd.DataFrame:
+    """{ticker: Close 배열} → (ticker, field) 멀티컬럼 DataFrame"""
+    n = len(next(iter(closes.values())))
+    idx = pd.bdate_range("2024-01-01", periods=n)
+    cols = pd.MultiIndex.from_tuples([(t, "Close") for t in closes])
+    return pd.DataFrame(np.column_stack(list(closes.values())), index=idx, columns=cols)
+
+
+def test_interior_gap_keeps_ma_points():
+    """내부 결측일은 건너뛰고 앞뒤 관측치로 MA를 이어서 계산 (결측 주변 MA가 사라지지 않음)"""
+    a = np.arange(1.0, 61.0)
+    a[30] = np.nan  # 31번째 날 결측
+    df = _ohlc({"GAP": a, "FULL": np.arange(1.0, 61.0)})
+
+    ma = compute_ma20(df)["GAP"]
+
+    # 관측치 59개 → MA 59 - 19 = 40개, 결측일은 인덱스에 없음
+    assert len(ma) == 40
+    assert df.index[30] not in ma.index
+    # 결측 직후 첫 MA: 값 12..30과 32의 평균 = (399 + 32) / 20
+    assert np.isclose(ma[df.index[31]], 21.55)
+    # 결측 이전/이후 구간은 일반 MA와 동일
+    assert np.isclose(ma[df.index[29]], np.mean(np.arange(11.0, 31.0)))
+    assert np.isclose(ma.iloc[-1], np.mean(np.arange(41.0, 61.0)))
+
+
+def test_gapped_matches_per_ticker_rolling():
+    """결측 패턴과 무관하게 티커별 dropna → rolling 결과와 일치"""
+    rng = np.random.default_rng(0)
+    n = 120
+    data = {t: 100 + rng.standard_normal(n).cumsum() for t in ("A", "B", "C", "D")}
+    data["A"][[10, 50, 51, 90]] = np.nan  # 내부 결측
+    data["B"][:15] = np.nan               # 늦은 상장 (앞쪽 결측)
+    data["C"][-7:] = np.nan               # 뒤쪽 결측
+    df = _ohlc(data)
+
+    out = compute_ma20(df)
+
+    assert list(out) == ["A", "B", "C", "D"]
+    for t in out:
+        expected = df[(t, "Close")].dropna().rolling(MA_WINDOW).mean().dropna()
+        pd.testing.assert_series_equal(out[t], expected, check_names=False)
+
+
+def test_short_series_skipped():
+    """관측치가 MIN_MA_POINTS 미만인 티커는 제외"""
+    short = np.full(60, np.nan)
+    short[:20] = np.arange(1.0, 21.0)
+    df = _ohlc({"SHORT": short, "FULL": np.arange(1.0, 61.0)})
+
+    out = compute_ma20(df)
+
+    assert list(out) == ["FULL"]
+    assert len(out["FULL"]) == 60 - (MA_WINDOW - 1)
+
+
+if __name__ == "__main__":
+    test_interior_gap_keeps_ma_points()
+    test_gapped_matches_per_ticker_rolling()
+    test_short_series_skipped()
+    print("✅ compute_ma20 테스트 통과")
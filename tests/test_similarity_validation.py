@@ -19,10 +19,34 @@ from typing import List, Tuple, Dict
 import json
 from datetime import datetime
 
-from app.features import normalize_pipeline
+from app.features import zscore_matrix
 from app.similar import rank_top_k, ensemble_score
 from app.data_io import load_ma20_parquet
 
+# 기본 테스트 패턴 유형 (검증기 생성 시 길이 200으로 한 번만 계산)
+_BASE_PATTERN_TYPES = ("uptrend", "downtrend", "peak", "valley", "sine", "flat")
+_BASE_PATTERN_LEN = 200
+
+# 재현 가능한 노이즈 생성을 위한 고정 시드 난수 생성기 (PCG64)
+_RNG = np.random.default_rng(42)
+
+# DCG 순위 할인 계수 1/log2(rank + 1) (k ≤ 100까지 미리 계산)
+_DCG_DISCOUNT = 1.0 / np.log2(np.arange(2, 102))
+
+
+def _dcg_discount(n: int) -> np.ndarray:
+    """상위 n개 순위의 DCG 할인 계수"""
+    if n <= len(_DCG_DISCOUNT):
+        return _DCG_DISCOUNT[:n]
+    return 1.0 / np.log2(np.arange(2, n + 2))
+
+
+def _relevance_mask(retrieved: List[str], relevant: List[str], k: int) -> np.ndarray:
+    """상위 k개 검색 결과의 정답 여부 (0/1) - frozenset으로 O(1) 멤버십"""
+    relevant_set = frozenset(relevant)
+    top_k = retrieved[:k]
+    return np.fromiter((t in relevant_set for t in top_k), dtype=np.int8, count=len(top_k))
+
 
 class SimilarityValidator:
     """유사도 검증 클래스"""
@@ -30,13 +54,17 @@ class SimilarityValidator:
     def __init__(self):
         self.test_cases = []
         self.results = []
+        # 정규화까지 끝낸 기본 패턴 캐시 {pattern_type: 패턴}
+        base = self.build_patterns(_BASE_PATTERN_TYPES, _BASE_PATTERN_LEN)
+        self._base_patterns = dict(zip(_BASE_PATTERN_TYPES, base))
 
-    def create_test_pattern(self, pattern_type: str, length: int = 200) -> np.ndarray:
+    @staticmethod
+    def build_patterns(pattern_types: Tuple[str, ...], length: int = 200) -> np.ndarray:
         """
-        테스트 패턴 생성
+        테스트 패턴 여러 개를 한 매트릭스에 생성 후 행 단위로 한 번에 정규화
 
         Args:
-            pattern_type: 패턴 유형
+            pattern_types: 패턴 유형 목록
                 - "uptrend": 상승 추세
                 - "downtrend": 하락 추세
                 - "peak": 산 모양 (올라갔다 내려옴)
@@ -46,41 +74,55 @@ class SimilarityValidator:
             length: 패턴 길이
 
         Returns:
-            정규화된 패턴 (length 길이)
+            정규화된 패턴 매트릭스 (len(pattern_types) × length)
         """
         x = np.linspace(0, 1, length)
+        patterns = np.empty((len(pattern_types), length))
 
-        if pattern_type == "uptrend":
-            y = x  # 0 → 1 선형 증가
+        for i, pattern_type in enumerate(pattern_types):
+            if pattern_type == "uptrend":
+                patterns[i] = x  # 0 → 1 선형 증가
 
-        elif pattern_type == "downtrend":
-            y = 1 - x  # 1 → 0 선형 감소
+            elif pattern_type == "downtrend":
+                patterns[i] = 1 - x  # 1 → 0 선형 감소
 
-        elif pattern_type == "peak":
-            # 0 → 1 → 0 (산 모양)
-            y = np.where(x < 0.5, 2 * x, 2 * (1 - x))
+            elif pattern_type == "peak":
+                # 0 → 1 → 0 (산 모양)
+                patterns[i] = np.where(x < 0.5, 2 * x, 2 * (1 - x))
 
-        elif pattern_type == "valley":
-            # 1 → 0 → 1 (골짜기)
-            y = np.where(x < 0.5, 1 - 2 * x, 2 * x - 1)
+            elif pattern_type == "valley":
+                # 1 → 0 → 1 (골짜기)
+                patterns[i] = np.where(x < 0.5, 1 - 2 * x, 2 * x - 1)
 
-        elif pattern_type == "sine":
-            # 사인파 (2주기)
-            y = 0.5 + 0.5 * np.sin(4 * np.pi * x)
+            elif pattern_type == "sine":
+                # 사인파 (2주기)
+                patterns[i] = 0.5 + 0.5 * np.sin(4 * np.pi * x)
 
-        elif pattern_type == "flat":
-            # 평평함
-            y = np.ones(length) * 0.5
+            elif pattern_type == "flat":
+                # 평평함
+                patterns[i] = 0.5
 
-        else:
-            raise ValueError(f"Unknown pattern type: {pattern_type}")
+            else:
+                raise ValueError(f"Unknown pattern type: {pattern_type}")
 
-        # Z-score 정규화
-        return normalize_pipeline(y, length)
+        # Z-score 정규화 (길이가 같으므로 리샘플링 없이 행 단위 정규화)
+        return zscore_matrix(patterns)
 
-    def add_noise(self, pattern: np.ndarray, noise_level: float = 0.1) -> np.ndarray:
-        """패턴에 노이즈 추가"""
-        noise = np.random.normal(0, noise_level, len(pattern))
+    def create_test_pattern(self, pattern_type: str, length: int = 200) -> np.ndarray:
+        """
+        테스트 패턴 생성 (build_patterns 참고, 기본 길이는 캐시에서 복사)
+
+        Returns:
+            정규화된 패턴 (length 길이)
+        """
+        if length == _BASE_PATTERN_LEN and pattern_type in self._base_patterns:
+            return self._base_patterns[pattern_type].copy()
+        return self.build_patterns((pattern_type,), length)[0]
+
+    def add_noise(self, pattern: np.ndarray, noise_level: float = 0.1,
+                  rng: np.random.Generator = _RNG) -> np.ndarray:
+        """패턴(또는 패턴 매트릭스 전체)에 노이즈 추가"""
+        noise = rng.standard_normal(pattern.shape) * noise_level
         return pattern + noise
 
     def generate_test_dataset(self) -> List[Dict]:
@@ -93,12 +135,17 @@ class SimilarityValidator:
         3. 노이즈 추가 패턴 (높음)
         4. 반대 패턴
         """
-        patterns = ["uptrend", "downtrend", "peak", "valley", "sine"]
+        patterns = ("uptrend", "downtrend", "peak", "valley", "sine")
         dataset = []
 
-        for pattern_type in patterns:
+        # 원본/노이즈 패턴을 패턴 수 × 길이 매트릭스로 한 번에 생성 (원본은 캐시 사용)
+        base = np.stack([self.create_test_pattern(p) for p in patterns])
+        noisy_low_all = self.add_noise(base, 0.1)
+        noisy_high_all = self.add_noise(base, 0.3)
+
+        for i, pattern_type in enumerate(patterns):
             # 원본 패턴
-            original = self.create_test_pattern(pattern_type)
+            original = base[i]
 
             # 테스트 케이스 1: 자기 자신 (100% 유사)
             dataset.append({
@@ -110,7 +157,7 @@ class SimilarityValidator:
             })
 
             # 테스트 케이스 2: 낮은 노이즈 (80%+ 유사)
-            noisy_low = self.add_noise(original, noise_level=0.1)
+            noisy_low = noisy_low_all[i]
             dataset.append({
                 "query_name": f"{pattern_type}_noisy_low",
                 "query_pattern": noisy_low.tolist(),
@@ -120,7 +167,7 @@ class SimilarityValidator:
             })
 
             # 테스트 케이스 3: 높은 노이즈 (50%+ 유사)
-            noisy_high = self.add_noise(original, noise_level=0.3)
+            noisy_high = noisy_high_all[i]
             dataset.append({
                 "query_name": f"{pattern_type}_noisy_high",
                 "query_pattern": noisy_high.tolist(),
@@ -130,8 +177,7 @@ class SimilarityValidator:
             })
 
         # 테스트 케이스 4: 반대 패턴 (낮은 유사도)
-        uptrend = self.create_test_pattern("uptrend")
-        downtrend = self.create_test_pattern("downtrend")
+        uptrend = base[patterns.index("uptrend")]
         dataset.append({
             "query_name": "uptrend_vs_downtrend",
             "query_pattern": uptrend.tolist(),
@@ -159,8 +205,7 @@ class SimilarityValidator:
         if k == 0 or len(retrieved) == 0:
             return 0.0
 
-        top_k = retrieved[:k]
-        num_relevant = sum(1 for item in top_k if item in relevant)
+        num_relevant = int(_relevance_mask(retrieved, relevant, k).sum())
         return num_relevant / k
 
     def evaluate_recall_at_k(self, retrieved: List[str], relevant: List[str], k: int = 5) -> float:
@@ -180,8 +225,7 @@ class SimilarityValidator:
         if len(relevant) == 0:
             return 0.0
 
-        top_k = retrieved[:k]
-        num_relevant = sum(1 for item in top_k if item in relevant)
+        num_relevant = int(_relevance_mask(retrieved, relevant, k).sum())
         return num_relevant / len(relevant)
 
     def evaluate_ndcg_at_k(self, retrieved: List[str], relevant: List[str], k: int = 5) -> float:
@@ -198,18 +242,12 @@ class SimilarityValidator:
         Returns:
             NDCG@K (0~1)
         """
-        def dcg(relevances):
-            """DCG 계산"""
-            return sum(rel / np.log2(i + 2) for i, rel in enumerate(relevances))
-
         # 실제 검색 결과의 relevance
-        actual_relevances = [1 if item in relevant else 0 for item in retrieved[:k]]
+        mask = _relevance_mask(retrieved, relevant, k)
+        actual_dcg = float(mask @ _dcg_discount(len(mask)))
 
         # 이상적인 순위 (모든 정답이 상위에)
-        ideal_relevances = sorted([1] * min(len(relevant), k) + [0] * (k - len(relevant)), reverse=True)
-
-        actual_dcg = dcg(actual_relevances)
-        ideal_dcg = dcg(ideal_relevances)
+        ideal_dcg = float(_dcg_discount(min(len(relevant), k)).sum()) if k > 0 else 0.0
 
         if ideal_dcg == 0:
             return 0.0
@@ -121,7 +121,7 @@ document.getElementById("search").onclick = async () => {
     // 캔버스 오버레이
     data.items.forEach(it => {
       const cv = document.getElementById(`cv_${it.rank}`);
-      drawOverlay(cv, it.sketch_norm, it.series_norm);
+      drawOverlay(cv, data.sketch_norm, it.series_norm);
     });
 
     toast(`총 ${data.items.length}개 결과`);